@@ -4,14 +4,26 @@ from flask_cors import CORS
 from .models import setup_db
 from .errors import setup_errors
 from .routes import setup_routes
+from .profiling import setup_profiling
+from .metrics import setup_metrics
+from .replicas import setup_replicas
+from .catalog import setup_catalog
+from .compression import setup_compression
+from .assets import setup_assets
 
 
 def create_app(test_config=None):
     app = Flask(__name__)
-    CORS(app)
+    CORS(app, expose_headers=["ETag", "X-Query-Count", "Server-Timing"])
     setup_db(app)
     setup_errors(app)
+    setup_profiling(app)
+    setup_metrics(app)
+    setup_replicas(app)
     setup_routes(app)
+    setup_catalog(app)
+    setup_assets(app)
+    setup_compression(app)
     return app
 
 
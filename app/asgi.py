@@ -0,0 +1,275 @@
+'''
+ASGI entry point: `uvicorn app.asgi:ASGI_APP`, next to `gunicorn app:APP`.
+
+SQLAlchemy 1.3 and Flask 1.1 have no asyncio support, so the routes, models,
+errors and auth are served as they are: each request runs on a worker thread
+of a pool of ASGI_THREADS while the event loop only moves bytes. Concurrency
+is bounded by the threads (and DB_POOL_SIZE + DB_MAX_OVERFLOW) rather than by
+the number of processes, and signing keys are fetched at startup off the loop.
+'''
+import sys
+import asyncio
+import functools
+import logging
+import threading
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, CancelledError, TimeoutError as FutureTimeout
+from http.client import responses as STATUS_TEXT
+from .config import ASGI_THREADS
+
+logger = logging.getLogger(__name__)
+
+# request bodies over this size are spooled to disk
+SPOOL_SIZE = 1024 * 1024
+# seconds a worker waits on a full queue before checking whether the request was dropped
+PUT_POLL = 1.0
+
+
+class Disconnected(Exception):
+    '''The client went away or the ASGI call ended: the response is dropped'''
+
+
+def build_environ(scope, body):
+    '''WSGI environ of an ASGI http scope'''
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name, value = name.decode("latin1").upper().replace("-", "_"), value.decode("latin1")
+        key = name if name in ("CONTENT_TYPE", "CONTENT_LENGTH") else f"HTTP_{name}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class WsgiToAsgi:
+    '''
+    ASGI app serving a WSGI app. A request runs start to end on one worker thread,
+    so Flask contexts and the thread-scoped session hold for streamed bodies too;
+    chunks are handed to the loop through a bounded queue (backpressure).
+    @INPUTS
+        wsgi_app: WSGI callable, i.e. APP.wsgi_app
+        threads: worker threads
+        startup: callable run on a worker thread at lifespan startup
+    '''
+
+    def __init__(self, wsgi_app, threads=ASGI_THREADS, startup=None):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="asgi")
+        self.startup = startup
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] != "http":
+            raise ValueError(f"unsupported ASGI scope {scope['type']}")
+
+        body = await self.read_body(receive)
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=8)
+        cancelled = threading.Event()
+        loop.run_in_executor(self.executor, self.run, build_environ(scope, body), loop, queue, cancelled)
+
+        started, chunk = False, None
+        disconnect = asyncio.ensure_future(self.wait_disconnect(receive))
+        try:
+            while True:
+                chunk = asyncio.ensure_future(queue.get())
+                await asyncio.wait({chunk, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                if not chunk.done():
+                    return
+                kind, value = chunk.result()
+                if kind == "error" and not started:
+                    await send({"type": "http.response.start", "status": 500,
+                                "headers": [(b"content-type", b"text/plain")]})
+                    await send({"type": "http.response.body", "body": b"Internal Server Error"})
+                    return
+                if kind == "error":
+                    # the response started: raise so the server drops the connection, as
+                    # gunicorn does, rather than end a body that was cut short
+                    raise RuntimeError("response body cut short") from value
+                if kind == "start":
+                    status, headers = value
+                    await send({"type": "http.response.start", "status": status, "headers": headers})
+                    started = True
+                elif kind == "body":
+                    await send({"type": "http.response.body", "body": value, "more_body": True})
+                else:
+                    await send({"type": "http.response.body", "body": b""})
+                    return
+        finally:
+            # done, disconnected or cancelled by the server: stop the worker, and free
+            # the queue so a put it is blocked on returns
+            cancelled.set()
+            while not queue.empty():
+                queue.get_nowait()
+            if chunk is not None:
+                chunk.cancel()
+            disconnect.cancel()
+            body.close()
+
+    def run(self, environ, loop, queue, cancelled):
+        '''Serve one request on a worker thread, handing the response to the loop'''
+
+        def put(kind, value=None):
+            if cancelled.is_set():
+                raise Disconnected()
+            try:
+                future = asyncio.run_coroutine_threadsafe(queue.put((kind, value)), loop)
+            except RuntimeError:  # the loop is closed
+                raise Disconnected()
+            while True:
+                try:
+                    return future.result(timeout=PUT_POLL)
+                except CancelledError:  # by the loop shutting down
+                    raise Disconnected()
+                except FutureTimeout:
+                    if cancelled.is_set():
+                        future.cancel()
+                        raise Disconnected()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["start"] = (int(status.split(" ", 1)[0]),
+                                 [(name.lower().encode("latin1"), value.encode("latin1")) for name, value in headers])
+
+        try:
+            iterable = self.wsgi_app(environ, start_response)
+            try:
+                for chunk in iterable:
+                    if "start" in response:
+                        put("start", response.pop("start"))
+                    if cancelled.is_set():
+                        break
+                    if chunk:
+                        put("body", chunk)
+            finally:
+                if hasattr(iterable, "close"):
+                    iterable.close()
+            if "start" in response:
+                put("start", response.pop("start"))
+            put("end")
+        except Disconnected:
+            pass
+        except Exception as error:
+            logger.exception("ASGI request failed")
+            try:
+                put("error", error)
+            except Disconnected:
+                pass
+
+    async def read_body(self, receive):
+        body = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            body.write(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body.seek(0)
+        return body
+
+    async def wait_disconnect(self, receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    async def lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                try:
+                    if self.startup:
+                        await loop.run_in_executor(self.executor, self.startup)
+                except Exception as error:
+                    await send({"type": "lifespan.startup.failed", "message": str(error)})
+                    return
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                # off the loop: workers still handing chunks to it need it to finish
+                await loop.run_in_executor(None, functools.partial(self.executor.shutdown, wait=True))
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def asgi_to_wsgi(asgi_app):
+    '''
+    WSGI callable driving an ASGI app, one event loop per request, the response
+    body buffered: lets WSGI test clients run against the ASGI entry point
+    '''
+
+    def wsgi_app(environ, start_response):
+        headers = [(key[5:].replace("_", "-").lower().encode("latin1"), value.encode("latin1"))
+                   for key, value in environ.items()
+                   if key.startswith("HTTP_") and key not in ("HTTP_CONTENT_TYPE", "HTTP_CONTENT_LENGTH")]
+        for key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            if environ.get(key):
+                headers.append((key.replace("_", "-").lower().encode("latin1"), environ[key].encode("latin1")))
+        scope = {
+            "type": "http",
+            "http_version": environ.get("SERVER_PROTOCOL", "HTTP/1.1").split("/")[-1],
+            "method": environ["REQUEST_METHOD"],
+            "scheme": environ.get("wsgi.url_scheme", "http"),
+            "root_path": environ.get("SCRIPT_NAME", "").encode("latin1").decode("utf8"),
+            "path": environ.get("PATH_INFO", "").encode("latin1").decode("utf8"),
+            "query_string": environ.get("QUERY_STRING", "").encode("latin1"),
+            "headers": headers,
+            "server": (environ.get("SERVER_NAME", "localhost"), int(environ.get("SERVER_PORT") or 80)),
+            "client": (environ.get("REMOTE_ADDR", ""), 0),
+        }
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+        request_body = environ["wsgi.input"].read(length) if length else b""
+        messages = [{"type": "http.request", "body": request_body, "more_body": False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            await asyncio.Event().wait()
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(asgi_app(scope, receive, send))
+        start = next(message for message in sent if message["type"] == "http.response.start")
+        start_response(f"{start['status']} {STATUS_TEXT.get(start['status'], '')}".strip(),
+                       [(name.decode("latin1"), value.decode("latin1")) for name, value in start["headers"]])
+        return [b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")]
+
+    return wsgi_app
+
+
+def prefetch_signing_keys():
+    from .auth import JWKS, IS_TESTING
+
+    if not IS_TESTING:
+        JWKS.refresh()
+
+
+def create_asgi_app():
+    from . import APP
+    from .feed import max_streams
+
+    # /feed streams hold one of these threads each
+    APP.config["WORKER_THREADS"] = ASGI_THREADS
+    max_streams(APP.config)
+    return WsgiToAsgi(APP.wsgi_app, startup=prefetch_signing_keys)
+
+ASGI_APP = create_asgi_app()
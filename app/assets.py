@@ -0,0 +1,121 @@
+'''
+Fingerprinted, precompressed static assets: `flask assets build` copies each file
+of app/static to app/static/dist/<name>.<content hash>.<ext>, next to its .gz
+(and .br, with brotli installed) at the highest level, and writes a manifest.
+Templates link them through asset_url(), falling back to /static before a build;
+/assets/ serves the variant the client accepts, cached for a year since a
+changed file gets a new name.
+'''
+import os
+import gzip
+import json
+import shutil
+import hashlib
+import mimetypes
+from functools import lru_cache
+import click
+from flask import url_for, request, send_from_directory, abort
+from flask.cli import AppGroup
+from .compression import brotli
+from .profiling import query_budget
+
+ASSETS = ("components.js", "style.css")
+MANIFEST = "manifest.json"
+MAX_AGE = 365 * 24 * 3600
+# content coding -> file suffix, preferred first
+VARIANTS = {"br": ".br", "gzip": ".gz"} if brotli is not None else {"gzip": ".gz"}
+
+
+def fingerprint(filename, content):
+    '''components.js -> components.<hash of content>.js'''
+    name, ext = os.path.splitext(filename)
+    return f"{name}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+
+
+def build_assets(source, target, assets=ASSETS):
+    '''
+    Write the fingerprinted and precompressed copies of the assets, and their manifest
+    @INPUTS
+        source: static folder
+        target: build folder, emptied first
+    @RETURNS
+        manifest: { filename: fingerprinted filename }
+    '''
+    shutil.rmtree(target, ignore_errors=True)
+    os.makedirs(target)
+    manifest = {}
+    for filename in assets:
+        with open(os.path.join(source, filename), "rb") as f:
+            content = f.read()
+        built = manifest[filename] = fingerprint(filename, content)
+        variants = {built: content, built + ".gz": gzip.compress(content, 9, mtime=0)}
+        if brotli is not None:
+            variants[built + ".br"] = brotli.compress(content, quality=11)
+        for name, data in variants.items():
+            with open(os.path.join(target, name), "wb") as f:
+                f.write(data)
+    with open(os.path.join(target, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    load_manifest.cache_clear()
+    return manifest
+
+
+@lru_cache(maxsize=None)
+def load_manifest(directory):
+    '''The manifest of a build, {} before one'''
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def assets_dir(app):
+    return app.config.get("ASSETS_DIR") or os.path.join(app.static_folder, "dist")
+
+
+assets = AppGroup("assets", help="Static assets")
+
+
+@assets.command("build")
+def build_command():
+    '''Fingerprint and precompress the static assets, run at deploy (bin/post_compile)'''
+    from flask import current_app
+
+    target = assets_dir(current_app)
+    for filename, built in build_assets(current_app.static_folder, target).items():
+        click.echo(f"{filename} -> {os.path.join(target, built)}")
+
+
+def setup_assets(app):
+    '''
+    Add asset_url() to templates, the /assets/ route and the `flask assets` commands
+    '''
+    app.cli.add_command(assets)
+
+    @app.template_global()
+    def asset_url(filename):
+        built = load_manifest(assets_dir(app)).get(filename)
+        if built is None:
+            return url_for("static", filename=filename)
+        return url_for("asset", filename=built)
+
+    @app.route("/assets/<filename>", methods=["GET"])
+    @query_budget(0)
+    def asset(filename):
+        '''GET /assets/:filename - A built asset, precompressed when the client accepts it'''
+        directory = assets_dir(app)
+        if filename not in load_manifest(directory).values():
+            abort(404)
+
+        coding = request.accept_encodings.best_match(
+            [coding for coding, suffix in VARIANTS.items() if os.path.exists(os.path.join(directory, filename + suffix))])
+        mimetype = mimetypes.guess_type(filename)[0]
+        response = send_from_directory(directory, filename + VARIANTS[coding] if coding else filename,
+                                       mimetype=mimetype, cache_timeout=MAX_AGE)
+        if coding:
+            response.headers["Content-Encoding"] = coding
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
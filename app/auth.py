@@ -1,15 +1,31 @@
 import os
-import json
+import hashlib
 from flask import request, _request_ctx_stack
 from functools import wraps
 from jose import jwt
-from urllib.request import urlopen
 import re
 from .config import BASE_URL, AUTH_DOMAIN, AUTH_CLIENT_ID, AUTH_AUDIENCE, TESTING_JWT_KEY
+from .config import JWKS_URL, JWKS_FILE, JWKS_TTL, TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL
+from .jwks import JWKSCache, url_fetcher, file_fetcher
+from .cache import LRUCache
+from .metrics import METRICS
 
 AUTH_ALGOS = ["RS256"]
 IS_TESTING = os.environ.get('FLASK_ENV') == 'testing'
 
+JWKS = JWKSCache(file_fetcher(JWKS_FILE) if JWKS_FILE else url_fetcher(JWKS_URL), ttl=JWKS_TTL)
+# verified payloads keyed by sha256(token); entries expire at the token's exp claim
+TOKEN_CACHE = LRUCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+
+
+@METRICS.collector
+def token_cache_counters():
+    stats = TOKEN_CACHE.stats()
+    return [
+        ("counter", "cache_hits_total", {"cache": "token"}, stats["hits"]),
+        ("counter", "cache_misses_total", {"cache": "token"}, stats["misses"]),
+    ]
+
 
 def login_url():
     domain = f"https://{AUTH_DOMAIN}"
@@ -69,29 +85,53 @@ def check_permissions(permission, payload):
     return True
 
 
+def token_cache_key(token):
+    '''Key of a token in TOKEN_CACHE'''
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+@METRICS.timed("auth_verify_seconds")
 def verify_decode_jwt(token):
     '''
-    Get JWT payload
+    Get JWT payload, served from the verified-token cache when possible
+    @INPUTS
+        token: a json web token (string)
+    '''
+    cache_key = token_cache_key(token)
+    cached = TOKEN_CACHE.get(cache_key)
+    if cached is not None:
+        kid, payload = cached
+        # a rotated-out signing key invalidates the tokens it verified: get_key refreshes
+        # stale keys and refetches (rate limited) a kid the cached key set lacks
+        if kid is None or JWKS.get_key(kid) is not None:
+            return payload
+        TOKEN_CACHE.delete(cache_key)
+
+    kid, payload = decode_jwt(token)
+    exp = payload.get("exp")
+    TOKEN_CACHE.set(cache_key, (kid, payload), expires_at=exp if isinstance(exp, (int, float)) else None)
+    return payload
+
+
+def decode_jwt(token):
+    '''
+    Verify the JWT signature and claims
     @INPUTS
         token: a json web token (string)
+    @RETURNS
+        (kid, payload)
     '''
 
     if IS_TESTING:
-        return jwt.decode(token, TESTING_JWT_KEY)
-
-    jsonurl = urlopen(f"https://{AUTH_DOMAIN}/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
-    unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"],
-            }
+        return None, jwt.decode(token, TESTING_JWT_KEY)
+
+    try:
+        unverified_header = jwt.get_unverified_header(token)
+    except Exception:
+        raise AuthError("invalid header: Unable to parse auth token", 401)
+
+    kid = unverified_header.get("kid")
+    rsa_key = JWKS.get_key(kid)
     if rsa_key:
         try:
             payload = jwt.decode(
@@ -101,7 +141,7 @@ def verify_decode_jwt(token):
                 audience=AUTH_AUDIENCE,
                 issuer="https://" + AUTH_DOMAIN + "/",
             )
-            return payload
+            return kid, payload
 
         except jwt.ExpiredSignatureError:
             raise AuthError("token expired", 401)
@@ -0,0 +1,62 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    Thread-safe, bounded least-recently-used cache
+        - entries may carry an absolute expiry (epoch seconds)
+        - hits / misses are counted for instrumentation
+    '''
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= time.time():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value, expires_at=None):
+        '''
+        Store a value
+        @INPUTS
+            expires_at: epoch seconds after which the entry is dropped (defaults to now + ttl)
+        '''
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        return len(self._data)
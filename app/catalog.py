@@ -0,0 +1,391 @@
+'''
+Catalog imports and exports: `flask catalog import|export`, POST /import/<kind>
+and GET /export/<table>.
+
+Imported records are parsed as the file is read and staged IMPORT_CHUNK at a time
+(COPY on Postgres, executemany elsewhere) into a temporary table, then merged into
+the catalog with a few set-based statements, in one transaction: only one chunk of
+the file is ever in memory.
+
+Exports read a read-only snapshot through a server-side cursor, STREAM_BATCH rows
+at a time, encoding (and gzipping) each batch as it arrives.
+'''
+import io
+import os
+import csv
+import json
+import time
+import zlib
+from collections import namedtuple
+import click
+from flask.cli import AppGroup
+from jsonschema import Draft7Validator
+from jsonschema.exceptions import best_match
+from sqlalchemy import MetaData, Table, Column, Integer, String, select, func, exists, and_, or_, text
+from .models import db, Movie, Actor, movie_actors, bump_versions, insert_ignoring_conflicts, commit
+from .models import get_versions, CHANGES
+from .serializers import dumps
+from . import schemas
+from .config import IMPORT_CHUNK, IMPORT_MAX_ERRORS, STREAM_BATCH
+
+# format -> mimetype
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+class ImportFormatError(ValueError):
+    '''
+    The file cannot be read in the given format
+    '''
+
+
+# model: merged into (None for cast links), key: unique fields, coerce: field -> type of CSV values,
+# permissions: all needed to import
+Kind = namedtuple("Kind", "model fields key schema coerce permissions")
+
+KINDS = {
+    "movies": Kind(Movie, ("title", "release_date"), ("title",), schemas.movie.create, {},
+                   ("movies:create", "movies:update")),
+    "actors": Kind(Actor, ("name", "age", "gender"), ("name",), schemas.actor.create, {"age": int},
+                   ("actors:create", "actors:update")),
+    "cast": Kind(None, ("title", "name"), ("title", "name"), schemas.cast.by_name, {},
+                 ("movies:update",)),
+}
+
+STAGING = MetaData()
+
+
+def staging_tables(kind, spec):
+    '''The rows as read (line, fields) and the last row of each key'''
+    def columns(options):
+        return [Column(field, Integer if field in spec.coerce else String, **options(field)) for field in spec.fields]
+
+    rows = Table(f"import_{kind}", STAGING, Column("line", Integer), *columns(lambda field: {}),
+                 prefixes=["TEMPORARY"])
+    latest = Table(f"import_{kind}_latest", STAGING, *columns(lambda field: {"primary_key": field in spec.key}),
+                   prefixes=["TEMPORARY"])
+    return rows, latest
+
+
+STAGED = {kind: staging_tables(kind, spec) for kind, spec in KINDS.items()}
+
+# table: exported, fields: columns in order, order: sort key, permissions: all needed to export
+Export = namedtuple("Export", "table fields order permissions")
+
+EXPORTS = {
+    "movies": Export(Movie.__table__, ("id", "title", "release_date", "updated_at", "change_seq"), ("id",),
+                     ("movies:list",)),
+    "actors": Export(Actor.__table__, ("id", "name", "age", "gender", "updated_at", "change_seq"), ("id",),
+                     ("actors:list",)),
+    "cast": Export(movie_actors, ("movie_id", "actor_id", "updated_at", "change_seq"), ("movie_id", "actor_id"),
+                   ("movies:list", "actors:list")),
+}
+
+
+def read_records(stream, format):
+    '''
+    Records of a CSV (with a header row) or NDJSON byte stream, parsed as it is read
+    @RETURNS
+        iterator of (line number, dict | None when the line is not a JSON object)
+    '''
+    lines = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        if format == "csv":
+            reader = csv.DictReader(lines)
+            try:
+                for row in reader:
+                    yield reader.line_num, row
+            except csv.Error as error:
+                raise ImportFormatError(f"line {reader.line_num}: {error}")
+        else:
+            for number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                yield number, record if isinstance(record, dict) else None
+    except UnicodeDecodeError:
+        raise ImportFormatError("not UTF-8")
+    finally:
+        # the caller owns the stream
+        lines.detach()
+
+
+def clean(spec, validator, record):
+    '''
+    The field values of a record, CSV strings converted
+    @RETURNS
+        (values tuple, None) or (None, error message)
+    '''
+    if record is None:
+        return None, "not a JSON object"
+    values = {}
+    for field in spec.fields:
+        value = record.get(field)
+        if value is None or value == "":
+            continue
+        if field in spec.coerce and isinstance(value, str):
+            try:
+                value = spec.coerce[field](value)
+            except ValueError:
+                return None, f"{field}: {value!r} is not a {spec.coerce[field].__name__}"
+        values[field] = value
+    error = best_match(validator.iter_errors(values))
+    if error is not None:
+        return None, error.message
+    return tuple(values.get(field) for field in spec.fields), None
+
+
+def stage(table, rows):
+    '''Load (line, *values) rows into a staging table: COPY on Postgres, executemany elsewhere'''
+    if db.session.get_bind().dialect.name == "postgresql":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(f"COPY {table.name} ({', '.join(table.c.keys())}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.close()
+    else:
+        keys = table.c.keys()
+        db.session.execute(table.insert(), [dict(zip(keys, row)) for row in rows])
+
+
+def merge(spec, rows, latest):
+    '''
+    Merge the staged rows: the last row of each key wins, existing records that
+    differ are updated, the others inserted
+    @RETURNS
+        { distinct, created, updated }
+    '''
+    # the last row of each key wins
+    last_lines = select([func.max(rows.c.line)]).group_by(*[rows.c[key] for key in spec.key])
+    db.session.execute(latest.insert().from_select(
+        spec.fields, select([rows.c[field] for field in spec.fields]).where(rows.c.line.in_(last_lines))))
+    distinct = db.session.execute(select([func.count()]).select_from(latest)).scalar()
+
+    target = spec.model.__table__
+    same_key = and_(*[latest.c[key] == target.c[key] for key in spec.key])
+    values = [field for field in spec.fields if field not in spec.key]
+    changed = or_(*[latest.c[field].is_distinct_from(target.c[field]) for field in values])
+    updated = db.session.execute(
+        target.update().where(exists().where(and_(same_key, changed)))
+        .values({field: select([latest.c[field]]).where(same_key).as_scalar() for field in values})).rowcount
+
+    new = select([latest.c[field] for field in spec.fields]).where(~exists().where(same_key))
+    created = db.session.execute(insert_ignoring_conflicts(target).from_select(spec.fields, new)).rowcount
+    return {"distinct": distinct, "created": created, "updated": updated}
+
+
+def merge_cast(rows, latest):
+    '''
+    Link the staged (title, name) pairs whose movie and actor exist, existing links are kept
+    @RETURNS
+        { distinct, created, updated, unmatched }
+    '''
+    db.session.execute(latest.insert().from_select(
+        ["title", "name"], select([rows.c.title, rows.c.name]).distinct()))
+    distinct = db.session.execute(select([func.count()]).select_from(latest)).scalar()
+
+    movies, actors = Movie.__table__, Actor.__table__
+    pairs = latest.join(movies, movies.c.title == latest.c.title).join(actors, actors.c.name == latest.c.name)
+    matched = db.session.execute(select([func.count()]).select_from(pairs)).scalar()
+    created = db.session.execute(insert_ignoring_conflicts(movie_actors).from_select(
+        ["movie_id", "actor_id"], select([movies.c.id, actors.c.id]).select_from(pairs))).rowcount
+    return {"distinct": distinct, "created": created, "updated": 0, "unmatched": distinct - matched}
+
+
+def import_records(kind, records, chunk=IMPORT_CHUNK, max_errors=IMPORT_MAX_ERRORS):
+    '''
+    Import records into the catalog, in one transaction
+    @INPUTS
+        kind: "movies" | "actors" | "cast" (title, name pairs)
+        records: iterator of (line, dict), i.e. read_records()
+        chunk: rows staged per statement
+        max_errors: rejected rows reported
+    @RETURNS
+        { kind, rows, rejected, errors: { line, message }[], duplicates,
+          created, updated, unchanged, unmatched (cast), seconds, rows_per_second }
+    '''
+    spec = KINDS[kind]
+    rows_table, latest = STAGED[kind]
+    validator = Draft7Validator(spec.schema)
+    start = time.perf_counter()
+    report = {"kind": kind, "rows": 0, "rejected": 0, "errors": []}
+
+    try:
+        connection = db.session.connection()
+        for table in (rows_table, latest):
+            # left over by an import that died with its connection still pooled
+            db.session.execute(text(f"DROP TABLE IF EXISTS {table.name}"))
+            table.create(connection)
+
+        staged, rows = 0, []
+        for line, record in records:
+            report["rows"] += 1
+            values, error = clean(spec, validator, record)
+            if error is not None:
+                report["rejected"] += 1
+                if len(report["errors"]) < max_errors:
+                    report["errors"].append({"line": line, "message": error})
+                continue
+            rows.append((line, *values))
+            if len(rows) >= chunk:
+                stage(rows_table, rows)
+                staged, rows = staged + len(rows), []
+        if rows:
+            stage(rows_table, rows)
+            staged += len(rows)
+
+        # the version rows stay locked until commit: only once the file is staged
+        bump_versions("movies", "actors")
+        merged = merge_cast(rows_table, latest) if spec.model is None else merge(spec, rows_table, latest)
+        for table in (rows_table, latest):
+            table.drop(connection)
+    except Exception:
+        db.session.rollback()
+        raise
+    commit()
+
+    seconds = time.perf_counter() - start
+    distinct = merged.pop("distinct")
+    report.update(merged, duplicates=staged - distinct,
+                  unchanged=distinct - merged["created"] - merged["updated"] - merged.get("unmatched", 0),
+                  seconds=round(seconds, 3), rows_per_second=round(report["rows"] / seconds) if seconds else 0)
+    return report
+
+
+def begin_snapshot():
+    '''
+    Start a read-only transaction whose statements all see the database as it is now:
+    REPEATABLE READ on Postgres, a deferred transaction on SQLite (writers wait for it)
+    @RETURNS
+        change_seq of the snapshot, GET /changes?since= picks up from it
+    '''
+    db.session.rollback()
+    if db.session.get_bind().dialect.name == "postgresql":
+        db.session.execute(text("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY"))
+    else:
+        db.session.execute(text("BEGIN"))
+    (head,) = get_versions(CHANGES)
+    return head
+
+
+def export_filename(table, format, compress=False):
+    return f"{table}.{format}" + (".gz" if compress else "")
+
+
+def plain(row):
+    return [value.isoformat() if hasattr(value, "isoformat") else value for value in row]
+
+
+def batches(result, size):
+    while True:
+        rows = result.fetchmany(size)
+        if not rows:
+            return
+        yield rows
+
+
+def encode(fields, batches, format):
+    '''Bytes of each batch of rows: CSV after a header row, or one JSON object per line'''
+    if format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+        yield buffer.getvalue().encode()
+        for rows in batches:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(plain(row) for row in rows)
+            yield buffer.getvalue().encode()
+    else:
+        for rows in batches:
+            yield b"".join(dumps(dict(zip(fields, plain(row)))) + b"\n" for row in rows)
+
+
+def gzipped(chunks):
+    '''One gzip stream of the chunks, compressed as they come'''
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_table(table, format, compress=False, batch=STREAM_BATCH):
+    '''
+    Every row of a table, read in the current transaction (see begin_snapshot)
+    through a server-side cursor: memory stays flat whatever the table size.
+    The select runs at once, the rows as the result is iterated.
+    @INPUTS
+        table: "movies" | "actors" | "cast" (movie_id, actor_id links)
+        format: "csv" | "ndjson"
+        compress: gzip the output
+        batch: rows fetched at a time
+    @RETURNS
+        iterator of bytes
+    '''
+    spec = EXPORTS[table]
+    query = select([spec.table.c[field] for field in spec.fields]) \
+        .order_by(*[spec.table.c[key] for key in spec.order]).execution_options(stream_results=True)
+    chunks = encode(spec.fields, batches(db.session.execute(query), batch), format)
+    return gzipped(chunks) if compress else chunks
+
+
+catalog = AppGroup("catalog", help="Import and export the catalog")
+
+
+@catalog.command("import")
+@click.argument("kind", type=click.Choice(list(KINDS)))
+@click.argument("file", type=click.File("rb"))
+@click.option("--format", "format", type=click.Choice(list(FORMATS)), help="Defaults to the file extension")
+@click.option("--chunk", default=IMPORT_CHUNK, show_default=True, help="Rows staged per statement")
+def import_command(kind, file, format, chunk):
+    '''
+    Import movies (title, release_date), actors (name, age, gender) or cast
+    links (title, name) from a CSV or NDJSON file, - for stdin.
+    Existing titles / names are updated.
+    '''
+    if format is None:
+        format = "csv" if file.name.endswith(".csv") else "ndjson"
+    try:
+        report = import_records(kind, read_records(file, format), chunk)
+    except ImportFormatError as error:
+        raise click.ClickException(str(error))
+
+    for error in report.pop("errors"):
+        click.echo(f"line {error['line']}: {error['message']}", err=True)
+    click.echo(", ".join(f"{key} {value}" for key, value in report.items()))
+
+
+@catalog.command("export")
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option("--format", "format", type=click.Choice(list(FORMATS)), default="csv", show_default=True)
+@click.option("--gzip", "compress", is_flag=True, help="Write <table>.<format>.gz files")
+@click.option("--table", "tables", type=click.Choice(list(EXPORTS)), multiple=True, help="Defaults to every table")
+def export_command(directory, format, compress, tables):
+    '''
+    Export movies, actors and cast links to DIRECTORY/<table>.<format>,
+    every table from the same snapshot of the database.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    seq = begin_snapshot()
+    try:
+        for table in tables or EXPORTS:
+            path = os.path.join(directory, export_filename(table, format, compress))
+            with open(path, "wb") as file:
+                for chunk in export_table(table, format, compress):
+                    file.write(chunk)
+            click.echo(f"{path} {os.path.getsize(path)} bytes")
+    finally:
+        db.session.rollback()
+    click.echo(f"change_seq {seq}, follow with GET /changes?since={seq}")
+
+
+def setup_catalog(app):
+    '''
+    Add the `flask catalog` commands
+    '''
+    app.cli.add_command(catalog)
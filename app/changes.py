@@ -0,0 +1,100 @@
+from sqlalchemy import select, and_, or_, exists
+from .models import db, Movie, Actor, movie_actors, Tombstone, get_versions, CHANGES
+
+# tables a client syncs, the permission each needs
+SYNCED = {"movies": "movies:list", "actors": "actors:list"}
+
+
+def seq_columns(tables):
+    columns = [Tombstone.change_seq]
+    if "movies" in tables:
+        columns.append(Movie.change_seq)
+    if "actors" in tables:
+        columns.append(Actor.change_seq)
+    return columns + [movie_actors.c.change_seq]
+
+
+def page_end(since, head, limit, tables):
+    '''
+    Last change_seq of a page holding about limit rows per table: a page ends on
+    a transaction boundary, so a transaction of more rows is returned whole
+    '''
+    end = head
+    for column in seq_columns(tables):
+        seq = db.session.query(column).filter(column > since, column <= end) \
+            .order_by(column).offset(limit).limit(1).scalar()
+        if seq is not None:
+            end = min(end, seq - 1 if seq - 1 > since else seq)
+    return end
+
+
+def isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def changed_rows(model, fields, since, end):
+    table = model.__table__
+    query = select([table.c[field] for field in fields] + [table.c.updated_at, table.c.change_seq]) \
+        .where(and_(table.c.change_seq > since, table.c.change_seq <= end)).order_by(table.c.change_seq, table.c.id)
+    return [dict(zip(fields, row[:-2]), updated_at=isoformat(row[-2]), change_seq=row[-1])
+            for row in db.session.execute(query)]
+
+
+def changed_links(since, end):
+    query = select([movie_actors.c.movie_id, movie_actors.c.actor_id, movie_actors.c.change_seq]) \
+        .where(and_(movie_actors.c.change_seq > since, movie_actors.c.change_seq <= end)) \
+        .order_by(movie_actors.c.change_seq)
+    return [{"movie_id": movie_id, "actor_id": actor_id, "change_seq": seq}
+            for movie_id, actor_id, seq in db.session.execute(query)]
+
+
+def deletions(since, end, tables):
+    '''Tombstones of the page, but for rows that exist again (a cast link added back)'''
+    restored = or_(
+        and_(Tombstone.table_name == "movies", exists().where(Movie.id == Tombstone.record_id)),
+        and_(Tombstone.table_name == "actors", exists().where(Actor.id == Tombstone.record_id)),
+        and_(Tombstone.table_name == "movie_actors", exists().where(and_(
+            movie_actors.c.movie_id == Tombstone.record_id, movie_actors.c.actor_id == Tombstone.related_id))),
+    )
+    query = select([Tombstone.table_name, Tombstone.record_id, Tombstone.related_id, Tombstone.change_seq]) \
+        .where(and_(Tombstone.change_seq > since, Tombstone.change_seq <= end,
+                    Tombstone.table_name.in_(list(tables) + ["movie_actors"]), ~restored)) \
+        .order_by(Tombstone.change_seq, Tombstone.id)
+
+    deleted = {table: [] for table in tables}
+    deleted["cast"] = []
+    for table_name, record_id, related_id, seq in db.session.execute(query):
+        if table_name == "movie_actors":
+            deleted["cast"].append({"movie_id": record_id, "actor_id": related_id, "change_seq": seq})
+        else:
+            deleted[table_name].append({"id": record_id, "change_seq": seq})
+    return deleted
+
+
+def changes_since(since, limit, tables):
+    '''
+    What was written after change since, in whole transactions
+    @INPUTS
+        since: change_seq the client synced up to, 0 for everything
+        limit: about how many rows per table
+        tables: synced tables the client may read, i.e. ("movies", "actors")
+    @RETURNS
+        { movies?, actors?, cast, deleted: { movies?, actors?, cast }, next, more },
+        None when since is ahead of the database (i.e. restored from a backup)
+    '''
+    # transactions commit in change_seq order: everything up to head is committed
+    (head,) = get_versions(CHANGES)
+    if since > head:
+        return None
+    end = page_end(since, head, limit, tables)
+
+    changes = {}
+    if "movies" in tables:
+        changes["movies"] = changed_rows(Movie, ("id", "title", "release_date"), since, end)
+    if "actors" in tables:
+        changes["actors"] = changed_rows(Actor, ("id", "name", "age", "gender"), since, end)
+    changes["cast"] = changed_links(since, end)
+    changes["deleted"] = deletions(since, end, tables)
+    changes["next"] = end
+    changes["more"] = end < head
+    return changes
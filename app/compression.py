@@ -0,0 +1,125 @@
+'''
+gzip / brotli compression of responses, negotiated on Accept-Encoding.
+
+Buffered responses are compressed whole when they reach COMPRESS_MIN_SIZE bytes,
+streamed ones chunk by chunk as they are sent, whatever their size. Files sent
+as they are (static files, precompressed assets, see assets.py), already encoded
+bodies (gzip exports) and event streams are left alone.
+'''
+import zlib
+from flask import request
+from .config import COMPRESS_MIN_SIZE, COMPRESS_LEVEL, BROTLI_QUALITY
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional, gzip only without it
+    brotli = None
+
+COMPRESSIBLE = {
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "text/javascript",
+    "text/html",
+    "text/css",
+    "text/csv",
+    "text/plain",
+}
+
+
+class GzipEncoder:
+    '''A gzip stream, fed chunk by chunk'''
+
+    def __init__(self, level=COMPRESS_LEVEL):
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+class BrotliEncoder:
+    '''A brotli stream, fed chunk by chunk'''
+
+    def __init__(self, quality=BROTLI_QUALITY):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def finish(self):
+        return self.compressor.finish()
+
+
+# content coding -> encoder, preferred first
+ENCODERS = {"gzip": GzipEncoder}
+if brotli is not None:
+    ENCODERS = {"br": BrotliEncoder, **ENCODERS}
+
+
+def negotiate(codings=None):
+    '''The content coding of the request's Accept-Encoding to answer with, None for identity'''
+    codings = list(ENCODERS) if codings is None else codings
+    return request.accept_encodings.best_match(codings) if codings else None
+
+
+def compressed_chunks(chunks, encoder):
+    '''Compress an iterable body as it is sent, closing it (and its app context) after'''
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            data = encoder.compress(chunk)
+            if data:
+                yield data
+        yield encoder.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def compress_response(response, min_size=COMPRESS_MIN_SIZE):
+    '''
+    Compress a response when the client accepts it and it is worth it
+    @INPUTS
+        response: flask Response
+        min_size: smallest buffered body compressed, in bytes
+    '''
+    if (response.status_code < 200 or response.status_code in (204, 206, 304) or request.method == "HEAD"
+            or response.direct_passthrough or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE):
+        return response
+    response.vary.add("Accept-Encoding")
+
+    coding = negotiate()
+    if coding is None:
+        return response
+    encoder = ENCODERS[coding]()
+
+    if response.is_streamed:
+        response.response = compressed_chunks(response.response, encoder)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(encoder.compress(data) + encoder.finish())
+
+    response.headers["Content-Encoding"] = coding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # a strong ETag names these exact bytes
+        response.set_etag(f"{etag}-{coding}")
+    return response
+
+
+def setup_compression(app):
+    '''
+    Compress responses of COMPRESSIBLE types, app.config COMPRESS_MIN_SIZE overriding the environment
+    '''
+
+    @app.after_request
+    def compress(response):
+        return compress_response(response, app.config.get("COMPRESS_MIN_SIZE", COMPRESS_MIN_SIZE))
@@ -0,0 +1,69 @@
+import hashlib
+from functools import wraps
+from flask import request, make_response, Response, g
+from .models import get_versions
+from .streaming import wants_ndjson
+
+
+def resource_etag(resources, id=None):
+    '''
+    Weak ETag from the version counters of the tables a representation is built from
+    @INPUTS
+        resources: table names, i.e. ("movies",)
+        id: single resource id, if any
+    '''
+    versions = get_versions(*resources)
+    tag = "-".join(f"{name}.{version}" for name, version in zip(resources, versions))
+    return tag if id is None else f"{tag}-{id}"
+
+
+def representation(scope=None):
+    '''
+    What a body depends on besides the data: its format (negotiated on Accept or
+    ?stream=1), its fieldset and, for routes filtering by permission, the caller's scope
+    @RETURNS
+        "" for the plain JSON body, else a short digest
+    '''
+    format = "ndjson" if wants_ndjson() else "stream" if request.args.get("stream") == "1" else "json"
+    parts = [f"{name}={request.args[name]}" for name in ("fields", "expand") if name in request.args]
+    if scope is not None:
+        parts.append("scope=" + ",".join(sorted(scope)))
+    if format == "json" and not parts:
+        return ""
+    return hashlib.sha256(";".join([format, *parts]).encode()).hexdigest()[:12]
+
+
+def conditional(*resources, scoped=False):
+    '''
+    Conditional GET decorator: answers 304 Not Modified with no body
+    when If-None-Match holds the current ETag of the resources, in the
+    representation asked for (Vary: Accept)
+    @INPUTS
+        resources: table names the response is built from
+        scoped: the body depends on the caller's permissions (Vary: Authorization),
+            after requires_auth
+    '''
+
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            scope = args[0].get("permissions", []) if scoped else None
+            etag = resource_etag(resources, kwargs.get("id"))
+            variant = representation(scope)
+            etag = g.etag = f"{etag}-{variant}" if variant else etag
+            vary = ("Accept", "Authorization") if scoped else ("Accept",)
+
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag, weak=True)
+            else:
+                response = make_response(f(*args, **kwargs))
+                if response.status_code == 200:
+                    response.set_etag(etag, weak=True)
+            for header in vary:
+                response.vary.add(header)
+            return response
+
+        return wrapper
+
+    return conditional_decorator
@@ -6,4 +6,66 @@ AUTH_DOMAIN = os.environ.get("AUTH_DOMAIN")
 AUTH_CLIENT_ID = os.environ.get("AUTH_CLIENT_ID")
 AUTH_AUDIENCE = os.environ.get("AUTH_AUDIENCE")
 
+JWKS_URL = os.environ.get("JWKS_URL", f"https://{AUTH_DOMAIN}/.well-known/jwks.json")
+JWKS_FILE = os.environ.get("JWKS_FILE")
+JWKS_TTL = int(os.environ.get("JWKS_TTL", 600))
+
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 4096))
+TOKEN_CACHE_TTL = int(os.environ.get("TOKEN_CACHE_TTL", 300))
+
 TESTING_JWT_KEY = 'capstoneTesting'
+
+PAGE_LIMIT = int(os.environ.get("PAGE_LIMIT", 50))
+PAGE_LIMIT_MAX = int(os.environ.get("PAGE_LIMIT_MAX", 1000))
+STREAM_BATCH = int(os.environ.get("STREAM_BATCH", 500))
+
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 256))
+RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 3600))
+RESPONSE_CACHE_URL = os.environ.get("RESPONSE_CACHE_URL")
+
+BULK_LIMIT = int(os.environ.get("BULK_LIMIT", 1000))
+
+SEARCH_THRESHOLD = float(os.environ.get("SEARCH_THRESHOLD", 0.3))
+SEARCH_MAX = int(os.environ.get("SEARCH_MAX", 1000))
+
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH = float(os.environ.get("METRICS_FLUSH", 1))
+
+READY_TIMEOUT = float(os.environ.get("READY_TIMEOUT", 2))
+STATS_TTL = int(os.environ.get("STATS_TTL", 30))
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT = int(os.environ.get("DB_STATEMENT_TIMEOUT", 30000))
+DB_POOLER = os.environ.get("DB_POOLER", "")
+
+# comma separated, i.e. postgres://replica-1/capstone,postgres://replica-2/capstone
+DATABASE_REPLICA_URLS = [url for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url]
+REPLICA_RETRY = int(os.environ.get("REPLICA_RETRY", 30))
+REPLICA_STICKY = int(os.environ.get("REPLICA_STICKY", 10))
+
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 32))
+# threads of a gunicorn worker, the Procfile passes it to --threads
+GUNICORN_THREADS = int(os.environ.get("GUNICORN_THREADS", 32))
+
+FEED_BUFFER = int(os.environ.get("FEED_BUFFER", 1000))
+FEED_POLL = float(os.environ.get("FEED_POLL", 5))
+FEED_HEARTBEAT = float(os.environ.get("FEED_HEARTBEAT", 15))
+FEED_MAX_AGE = float(os.environ.get("FEED_MAX_AGE", 300))
+# each open stream holds a worker thread: by default a worker takes as many streams as it has
+# threads but FEED_RESERVED_THREADS, which are left to the other requests
+FEED_RESERVED_THREADS = int(os.environ.get("FEED_RESERVED_THREADS", 8))
+FEED_MAX_STREAMS = int(os.environ["FEED_MAX_STREAMS"]) if os.environ.get("FEED_MAX_STREAMS") else None
+# LISTEN needs a session of its own: a direct URL when DATABASE_URL goes through a transaction mode pooler
+FEED_LISTEN_URL = os.environ.get("FEED_LISTEN_URL")
+
+# responses (JSON, NDJSON, CSV, HTML) of at least COMPRESS_MIN_SIZE bytes are gzip / brotli compressed
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 4))
+
+IMPORT_CHUNK = int(os.environ.get("IMPORT_CHUNK", 5000))
+IMPORT_MAX_ERRORS = int(os.environ.get("IMPORT_MAX_ERRORS", 100))
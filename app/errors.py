@@ -1,5 +1,6 @@
 from flask import jsonify
 from .auth import AuthError
+from sqlalchemy.exc import IntegrityError
 import jsonschema
 
 
@@ -57,7 +58,18 @@ def setup_errors(app):
         msg = error.description
         return jsonify({"success": False, "error": 500, "message": msg}), 500
 
+    # Handle 503 Service Unavailable
+    @app.errorhandler(503)
+    def error503(error):
+        msg = "Service Unavailable"
+        return jsonify({"success": False, "error": 503, "message": msg}), 503
+
     # Handle Validation Error
     @app.errorhandler(jsonschema.ValidationError)
     def onValidationError(e):
         return jsonify({"success": False, "error": 400, "message": "There was a validation error: " + str(e)}), 400
+
+    # Handle unique / foreign key violations not handled by the route
+    @app.errorhandler(IntegrityError)
+    def onIntegrityError(e):
+        return jsonify({"success": False, "error": 409, "message": "Conflict"}), 409
@@ -0,0 +1,297 @@
+'''
+Server-sent events of catalog changes, GET /feed.
+
+One pump thread per worker follows the change counter of GET /changes: it wakes on
+Postgres NOTIFY (sent at commit by a trigger on the counter, whichever process wrote)
+or, elsewhere, after each commit of this process and every FEED_POLL seconds.
+It reads each committed transaction once and keeps the last FEED_BUFFER of them
+in memory, rendered once per set of readable tables, for every stream of the worker.
+'''
+import time
+import select
+import logging
+import threading
+from collections import deque
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool
+from .models import db, get_versions, CHANGES, DB_URL
+from .changes import changes_since
+from .serializers import dumps
+from .config import FEED_BUFFER, FEED_POLL, FEED_HEARTBEAT, FEED_MAX_AGE, FEED_LISTEN_URL, PAGE_LIMIT_MAX
+from .config import FEED_MAX_STREAMS, FEED_RESERVED_THREADS, GUNICORN_THREADS
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "catalog_changes"
+TABLES = ("movies", "actors")
+# milliseconds before a browser reconnects a dropped stream, with Last-Event-ID
+RETRY = 3000
+
+
+class Event:
+    '''
+    The changes of one write transaction, shaped like a GET /changes response
+    '''
+
+    def __init__(self, seq, changes):
+        self.seq = seq
+        self.changes = changes
+        self.rendered = {}
+
+    def render(self, tables):
+        '''The SSE message of the changes in tables (and the cast), b"" when there are none'''
+        key = tuple(tables)
+        if key not in self.rendered:
+            deleted = self.changes["deleted"]
+            data = {table: self.changes[table] for table in tables}
+            data["cast"] = self.changes["cast"]
+            data["deleted"] = {table: deleted[table] for table in (*tables, "cast")}
+            if any(data[table] for table in (*tables, "cast")) or any(data["deleted"].values()):
+                self.rendered[key] = b"id: %d\nevent: change\ndata: %s\n\n" % (self.seq, dumps(data))
+            else:
+                self.rendered[key] = b""
+        return self.rendered[key]
+
+
+def split_events(changes, tables):
+    '''Events of a changes_since page, one per change_seq, in order'''
+    by_seq = {}
+
+    def changes_of(seq):
+        if seq not in by_seq:
+            by_seq[seq] = {**{table: [] for table in tables}, "cast": [],
+                           "deleted": {**{table: [] for table in tables}, "cast": []}}
+        return by_seq[seq]
+
+    for table in (*tables, "cast"):
+        for row in changes[table]:
+            changes_of(row["change_seq"])[table].append(row)
+        for row in changes["deleted"][table]:
+            changes_of(row["change_seq"])["deleted"][table].append(row)
+    return [Event(seq, by_seq[seq]) for seq in sorted(by_seq)]
+
+
+class LocalBroker:
+    '''Wakes the feed after each commit of this process, other processes' writes are polled'''
+
+    def __init__(self):
+        self._wake = threading.Event()
+
+    def publish(self):
+        self._wake.set()
+
+    def wait(self, timeout):
+        woke = self._wake.wait(timeout)
+        self._wake.clear()
+        return woke
+
+
+class PostgresBroker:
+    '''
+    Wakes the feed on NOTIFY catalog_changes, sent at commit by the trigger on the
+    change counter: writes of every worker and process are seen at once
+    '''
+
+    def __init__(self, url):
+        self.url = url
+        self.connection = None
+
+    def publish(self):
+        # the trigger notifies, in the writing transaction
+        pass
+
+    def connect(self):
+        connection = create_engine(self.url, poolclass=NullPool).raw_connection()
+        connection.connection.autocommit = True
+        cursor = connection.cursor()
+        cursor.execute(f"LISTEN {CHANNEL}")
+        cursor.close()
+        return connection
+
+    def wait(self, timeout):
+        try:
+            if self.connection is None:
+                self.connection = self.connect()
+            listening = self.connection.connection
+            if not select.select([listening], [], [], timeout)[0]:
+                return False
+            listening.poll()
+            woke = bool(listening.notifies)
+            listening.notifies.clear()
+            return woke
+        except Exception:
+            logger.exception("LISTEN %s failed, polling until it reconnects", CHANNEL)
+            self.close()
+            time.sleep(timeout)
+            return False
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+def make_broker(url):
+    if make_url(url).get_dialect().name == "postgresql":
+        return PostgresBroker(url)
+    return LocalBroker()
+
+
+class ChangeFeed:
+    '''
+    The recent events of the catalog, read by a pump thread and waited for by streams
+    @INPUTS
+        broker: LocalBroker | PostgresBroker
+        size: events kept in memory
+        poll: seconds between two reads without a wake up
+    '''
+
+    def __init__(self, broker, size=FEED_BUFFER, poll=FEED_POLL):
+        self.broker = broker
+        self.events = deque(maxlen=size)
+        self.poll = poll
+        # last change read, every event after complete is in self.events
+        self.seq = None
+        self.complete = None
+        self.streams = 0
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def start(self, app):
+        '''Start the pump thread of this process, once'''
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, args=(app,), name="feed", daemon=True)
+                self.thread.start()
+
+    def run(self, app):
+        while True:
+            try:
+                with app.app_context():
+                    self.read()
+            except Exception:
+                logger.exception("change feed read failed")
+            self.broker.wait(self.poll)
+
+    def read(self):
+        '''Buffer the transactions committed since the last read'''
+        if self.seq is None:
+            (head,) = get_versions(CHANGES)
+            self.append([], head)
+            return
+        while True:
+            changes = changes_since(self.seq, PAGE_LIMIT_MAX, TABLES)
+            if changes is None:
+                # the database went back (i.e. restored from a backup): follow it from its head
+                with self.condition:
+                    self.events.clear()
+                    self.seq = self.complete = None
+                return self.read()
+            self.append(split_events(changes, TABLES), changes["next"])
+            if not changes["more"]:
+                return
+
+    def append(self, events, seq):
+        with self.condition:
+            if self.seq is None:
+                self.complete = seq
+            for event in events:
+                if len(self.events) == self.events.maxlen:
+                    self.complete = self.events[0].seq
+                self.events.append(event)
+            self.seq = seq
+            self.condition.notify_all()
+
+    def open_stream(self, limit):
+        '''Count a new stream, False when limit streams are already open'''
+        with self.condition:
+            if self.streams >= limit:
+                return False
+            self.streams += 1
+            return True
+
+    def close_stream(self):
+        with self.condition:
+            self.streams -= 1
+
+    def after(self, seq, timeout):
+        '''
+        Buffered events after change seq, waiting up to timeout seconds for one
+        @RETURNS
+            (events, change read up to), None when seq is older than the buffer
+        '''
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq is not None and self.seq > seq, timeout)
+            if self.seq is None or self.seq <= seq:
+                return [], seq
+            if seq < self.complete:
+                return None
+            events = []
+            for event in reversed(self.events):
+                if event.seq <= seq:
+                    break
+                events.append(event)
+            return events[::-1], self.seq
+
+
+FEED = ChangeFeed(make_broker(FEED_LISTEN_URL or DB_URL))
+
+
+def max_streams(config):
+    '''
+    Streams a worker may hold open, each taking one of its threads for up to FEED_MAX_AGE
+    seconds: WORKER_THREADS (set by the ASGI entry point, GUNICORN_THREADS otherwise)
+    but FEED_RESERVED_THREADS, unless FEED_MAX_STREAMS is set. app.config keys override
+    the environment.
+    Raises ValueError when FEED_MAX_STREAMS would leave fewer than FEED_RESERVED_THREADS
+    threads to the other requests.
+    '''
+    threads = config.get("WORKER_THREADS", GUNICORN_THREADS)
+    available = threads - config.get("FEED_RESERVED_THREADS", FEED_RESERVED_THREADS)
+    limit = config.get("FEED_MAX_STREAMS", FEED_MAX_STREAMS)
+    if limit is None:
+        return max(available, 0)
+    if limit > available:
+        raise ValueError(f"FEED_MAX_STREAMS={limit} leaves fewer than FEED_RESERVED_THREADS "
+                         f"of the {threads} threads of a worker to other requests")
+    return limit
+
+
+@event.listens_for(db.session, "after_commit")
+def wake_feed(session):
+    FEED.broker.publish()
+
+
+def event_stream(feed, since, tables, max_age=FEED_MAX_AGE, heartbeat=FEED_HEARTBEAT):
+    '''
+    SSE messages of the changes after change since, for max_age seconds: the client
+    then reconnects with Last-Event-ID, which also spreads streams over workers.
+    A stream behind the buffer catches up from the database, without holding a
+    connection while it waits. Comments every heartbeat seconds keep proxies from
+    closing an idle stream and let the server notice clients that left.
+    @INPUTS
+        feed: ChangeFeed
+        since: change the client has
+        tables: tables the client may read
+    '''
+    yield b"retry: %d\n\n" % RETRY
+    deadline = time.monotonic() + max_age
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        found = feed.after(since, min(heartbeat, remaining))
+        if found is None:
+            changes = changes_since(since, PAGE_LIMIT_MAX, tables)
+            db.session.close()
+            if changes is None:
+                return
+            found = split_events(changes, tables), changes["next"]
+        events, since = found
+
+        messages = [message for message in (event.render(tables) for event in events) if message]
+        yield b"".join(messages) if messages else b": keepalive\n\n"
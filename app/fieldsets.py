@@ -0,0 +1,82 @@
+from collections import namedtuple
+from flask import request, abort
+from sqlalchemy.orm import load_only
+
+# fields: scalar fields to serialize
+# relations: relationship name -> nested fields, or None for the related model's full data()
+Fieldset = namedtuple("Fieldset", ["fields", "relations"])
+
+
+def split(value):
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+def parse_fieldset(model):
+    '''
+    Sparse fieldset from ?fields= and ?expand=, None when neither is given
+        - fields: scalar fields, i.e. fields=id,title (id is always included)
+        - expand: relationships to embed, in full (expand=actors) or
+          only some of their fields (expand=actors.id,actors.name)
+    Without expand no relationship is embedded, without fields every scalar is.
+    Aborts with 400 on unknown fields.
+    @INPUTS
+        model: Movie | Actor
+    '''
+    fields, expand = request.args.get("fields"), request.args.get("expand")
+    if fields is None and expand is None:
+        return None
+
+    scalars = ["id"] + [f for f in split(fields) if f != "id"] if fields is not None else list(model.FIELDS)
+    relations = {}
+    for item in split(expand or ""):
+        name, _, nested = item.partition(".")
+        if name not in model.RELATIONS:
+            abort(400)
+        if not nested:
+            relations[name] = model.RELATIONS[name]
+        elif relations.get(name, ()) is not None:
+            relations[name] = relations.get(name, ()) + (nested,)
+
+    if any(f not in model.FIELDS for f in scalars):
+        abort(400)
+    for name, nested in relations.items():
+        target = getattr(model, name).property.mapper.class_
+        if nested is not None and any(f not in target.FIELDS for f in nested):
+            abort(400)
+    return Fieldset(tuple(scalars), relations)
+
+
+def serialize(obj, fieldset):
+    '''Dict of the fields and relationships a fieldset asks for'''
+    data = {field: getattr(obj, field) for field in fieldset.fields}
+    for name, nested in fieldset.relations.items():
+        data[name] = [
+            related.data() if nested is None else {field: getattr(related, field) for field in nested}
+            for related in getattr(obj, name)
+        ]
+    return data
+
+
+def loader_options(model, fieldset, eager):
+    '''
+    Query options loading only what a fieldset serializes: its columns (plus the sort key)
+    and the expanded relationships
+    @INPUTS
+        model: Movie | Actor
+        fieldset: Fieldset
+        eager: relationship loader, subqueryload or selectinload
+    '''
+    columns = set(fieldset.fields) | {model.SORT_KEY}
+    options = [load_only(*[getattr(model, field) for field in columns])]
+    for name, nested in fieldset.relations.items():
+        relationship = getattr(model, name)
+        target = relationship.property.mapper.class_
+        loader = eager(relationship)
+        if nested is None:
+            # full data() of the related model, which walks its own relationships
+            for related in target.RELATIONS:
+                loader = loader.options(eager(getattr(target, related)))
+        else:
+            loader = loader.load_only(*[getattr(target, field) for field in set(nested) | {"id"}])
+        options.append(loader)
+    return options
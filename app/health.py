@@ -0,0 +1,104 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from .models import db
+from .config import READY_TIMEOUT, STATS_TTL
+
+
+class TableStats:
+    '''
+    Row counts of some tables, refreshed at most every ttl seconds:
+    pg_class.reltuples estimates on Postgres, COUNT(*) elsewhere and for the tables
+    without an estimate, all in one query. At most two queries a refresh.
+    While one request refreshes, the others get the previous counts.
+    '''
+
+    def __init__(self, tables, ttl=30):
+        self.tables = tables
+        self.ttl = ttl
+        self.value = None
+        self.refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        '''
+        @RETURNS
+            { table: rows, ..., "estimated": bool }
+        '''
+        if self.value is not None and time.monotonic() - self.refreshed_at < self.ttl:
+            return self.value
+        if not self._lock.acquire(blocking=self.value is None):
+            return self.value
+        try:
+            self.value = self.count()
+            self.refreshed_at = time.monotonic()
+        finally:
+            self._lock.release()
+        return self.value
+
+    def count(self):
+        estimates = self.estimates()
+        counts = dict(estimates)
+        missing = [table for table in self.tables if table not in estimates]
+        if missing:
+            selects = ", ".join(f"(SELECT COUNT(*) FROM {table})" for table in missing)
+            counts.update(zip(missing, db.session.execute(text(f"SELECT {selects}")).first()))
+        return {**{table: counts[table] for table in self.tables}, "estimated": bool(estimates)}
+
+    def estimates(self):
+        '''pg_class estimates of the tables that have one, {} off Postgres'''
+        if db.session.get_bind().dialect.name != "postgresql":
+            return {}
+        rows = db.session.execute(
+            text("SELECT relname, relpages, reltuples::bigint FROM pg_class "
+                 "WHERE relname IN :tables AND relkind = 'r'")
+            .bindparams(tables=tuple(self.tables)))
+        return usable_estimates(rows)
+
+    def clear(self):
+        self.value = None
+
+
+def usable_estimates(rows):
+    '''
+    The estimates of analyzed tables: a never analyzed one has reltuples = -1
+    from Postgres 14, reltuples = 0 and relpages = 0 before
+    @INPUTS
+        rows: (relname, relpages, reltuples) of pg_class
+    @RETURNS
+        { table: rows }
+    '''
+    return {name: tuples for name, pages, tuples in rows if pages > 0 and tuples > 0}
+
+
+TABLE_STATS = TableStats(["movies", "actors"], ttl=STATS_TTL)
+
+
+def stats_etag(stats):
+    '''ETag of a snapshot of the counts: it changes with the body, not with the tables'''
+    return "health-" + "-".join(f"{name}.{stats[name]}" for name in sorted(stats))
+
+# one ping at a time: while the database hangs, probes fail fast instead of queueing threads
+PING_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+_ping = None
+_ping_lock = threading.Lock()
+
+
+def ping(engine):
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+def database_ready(engine, timeout=READY_TIMEOUT):
+    '''Whether SELECT 1 answers within timeout seconds'''
+    global _ping
+    with _ping_lock:
+        if _ping is not None and not _ping.done():
+            return False
+        _ping = future = PING_EXECUTOR.submit(ping, engine)
+    try:
+        future.result(timeout=timeout)
+    except Exception:
+        return False
+    return True
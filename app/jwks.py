@@ -0,0 +1,130 @@
+import json
+import time
+import logging
+import threading
+from urllib.request import urlopen
+
+log = logging.getLogger(__name__)
+
+JWK_FIELDS = ("kty", "kid", "use", "n", "e")
+
+
+def url_fetcher(url, timeout=5):
+    '''
+    Build a fetcher that downloads a JWKS document over http(s)
+    @INPUTS
+        url: the jwks.json url
+        timeout: seconds to wait for the identity provider
+    '''
+
+    def fetch():
+        with urlopen(url, timeout=timeout) as res:
+            return json.loads(res.read())
+
+    return fetch
+
+
+def file_fetcher(path):
+    '''
+    Build a fetcher that reads a JWKS document from a local file (offline / tests)
+    @INPUTS
+        path: path to a jwks.json file
+    '''
+
+    def fetch():
+        with open(path) as f:
+            return json.load(f)
+
+    return fetch
+
+
+class JWKSCache:
+    '''
+    In-process cache of the identity provider signing keys, indexed by kid
+        - keys are fetched on first use and refreshed in the background once older than ttl
+        - an unknown kid triggers one synchronous refetch (at most every min_refetch seconds)
+        - when a refresh fails the last good keys keep being served
+    '''
+
+    def __init__(self, fetcher, ttl=600, min_refetch=30):
+        self.fetcher = fetcher
+        self.ttl = ttl
+        self.min_refetch = min_refetch
+        self._keys = {}
+        self._fetched_at = None
+        self._refetched_at = None
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def get_key(self, kid):
+        '''
+        Get the RSA key for a kid, or None if the provider does not know it
+        @INPUTS
+            kid: key id from the token header
+        '''
+        if self._fetched_at is None:
+            if self._may_refetch():
+                self.refresh()
+        elif time.monotonic() - self._fetched_at >= self.ttl:
+            self.refresh_in_background()
+
+        key = self._keys.get(kid)
+        if key is None and self._may_refetch():
+            self.refresh()
+            key = self._keys.get(kid)
+        return key
+
+    def kids(self):
+        '''Key ids currently known, without triggering a fetch'''
+        return set(self._keys)
+
+    def refresh(self):
+        '''
+        Fetch the JWKS document and swap in its keys.
+        Returns False (keeping the last good keys) if the fetch fails.
+        '''
+        with self._lock:
+            self._refetched_at = time.monotonic()
+        try:
+            jwks = self.fetcher()
+            keys = {
+                key["kid"]: {field: key.get(field) for field in JWK_FIELDS}
+                for key in jwks["keys"]
+            }
+        except Exception:
+            log.exception("JWKS refresh failed, serving last good keys")
+            return False
+
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.monotonic()
+        return True
+
+    def refresh_in_background(self):
+        '''Start a refresh thread unless one is already running'''
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="jwks-refresh", daemon=True).start()
+
+    def clear(self):
+        '''Forget all keys, the next lookup fetches again'''
+        with self._lock:
+            self._keys = {}
+            self._fetched_at = None
+            self._refetched_at = None
+
+    def _may_refetch(self):
+        with self._lock:
+            if self._refetched_at is None:
+                return True
+            return time.monotonic() - self._refetched_at >= self.min_refetch
@@ -0,0 +1,262 @@
+import os
+import json
+import time
+import atexit
+import threading
+from functools import wraps
+from flask import request, g
+from sqlalchemy.engine.url import make_url
+from .config import METRICS_DIR, METRICS_FLUSH
+
+# seconds, the Prometheus client defaults
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help) of the metrics the app records
+METRIC_TYPES = {
+    "http_requests_total": ("counter", "Requests by route, method and status"),
+    "http_request_duration_seconds": ("histogram", "Request latency by route and method"),
+    "auth_verify_seconds": ("histogram", "Time spent in verify_decode_jwt"),
+    "db_queries_total": ("counter", "SQL statements run by requests, by route"),
+    "db_request_seconds": ("histogram", "Time spent on DB calls per request, by route"),
+    "db_pool_checkout_seconds": ("histogram", "Wait for a pooled connection"),
+    "db_replica_failovers_total": ("counter", "Reads moved to the primary after a replica failed"),
+    "cache_hits_total": ("counter", "Cache hits, by cache"),
+    "cache_misses_total": ("counter", "Cache misses, by cache"),
+    "cache_hit_ratio": ("gauge", "Hits over lookups, by cache"),
+    "db_pool_size": ("gauge", "Connections the pools keep"),
+    "db_pool_checked_in": ("gauge", "Idle pooled connections"),
+    "db_pool_checked_out": ("gauge", "Pooled connections in use"),
+    "db_pool_overflow": ("gauge", "Connections opened over the pool size"),
+}
+
+
+def series_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Metrics:
+    '''
+    Counters and histograms of one process.
+    With a directory, each gunicorn worker dumps them to <directory>/<pid>.json
+    (at most every flush_interval seconds and at exit) and collect() sums every
+    worker's file: counters of exited workers are kept, gauges only of live ones.
+    '''
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+        self.flushed_at = 0.0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.flush, force=True)
+
+    def inc(self, name, value=1, **labels):
+        key = series_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = series_key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def timed(self, name, **labels):
+        '''Decorator observing the duration of each call in a histogram'''
+
+        def timed_decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start, **labels)
+
+            return wrapper
+
+        return timed_decorator
+
+    def collector(self, f):
+        '''
+        Register a function returning [(type, name, labels, value)] read at collection,
+        type being "counter" (a running total kept elsewhere) or "gauge"
+        '''
+        self.collectors.append(f)
+        return f
+
+    def snapshot(self):
+        '''JSON-able state of this process'''
+        with self._lock:
+            counters = [[name, dict(labels), value] for (name, labels), value in self.counters.items()]
+            histograms = [[name, dict(labels), dict(h, buckets=list(h["buckets"]))]
+                          for (name, labels), h in self.histograms.items()]
+        gauges = []
+        for collect in self.collectors:
+            for type, name, labels, value in collect():
+                (counters if type == "counter" else gauges).append([name, labels, value])
+        return {"pid": os.getpid(), "counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def flush(self, force=False):
+        '''Write this worker's snapshot, atomically, when due'''
+        now = time.monotonic()
+        if not self.directory or not force and now - self.flushed_at < self.flush_interval:
+            return
+        self.flushed_at = now
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            # metrics never fail a request, the next flush retries
+            pass
+
+    def snapshots(self):
+        '''Snapshots of every worker, this process' read live rather than from its file'''
+        own = self.snapshot()
+        others = []
+        if self.directory:
+            for filename in os.listdir(self.directory):
+                if not filename.endswith(".json") or filename == f"{own['pid']}.json":
+                    continue
+                try:
+                    with open(os.path.join(self.directory, filename)) as f:
+                        others.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return [own] + others
+
+    def collect(self):
+        '''
+        Every worker's metrics summed
+        @RETURNS
+            { "counters" | "gauges": { (name, labels): value }, "histograms": { (name, labels): histogram } }
+        '''
+        merged = {"counters": {}, "gauges": {}, "histograms": {}}
+        for snapshot in self.snapshots():
+            for name, labels, value in snapshot["counters"]:
+                key = series_key(name, labels)
+                merged["counters"][key] = merged["counters"].get(key, 0) + value
+            for name, labels, histogram in snapshot["histograms"]:
+                key = series_key(name, labels)
+                total = merged["histograms"].setdefault(key, {"buckets": [0] * len(BUCKETS), "sum": 0.0, "count": 0})
+                total["buckets"] = [a + b for a, b in zip(total["buckets"], histogram["buckets"])]
+                total["sum"] += histogram["sum"]
+                total["count"] += histogram["count"]
+            if is_alive(snapshot["pid"]):
+                for name, labels, value in snapshot["gauges"]:
+                    key = series_key(name, labels)
+                    merged["gauges"][key] = merged["gauges"].get(key, 0) + value
+
+        lookups = {}
+        for (name, labels), value in merged["counters"].items():
+            if name in ("cache_hits_total", "cache_misses_total"):
+                entry = lookups.setdefault(labels, [0, 0])
+                entry[name == "cache_misses_total"] += value
+        for labels, (hits, misses) in lookups.items():
+            merged["gauges"][("cache_hit_ratio", labels)] = hits / (hits + misses) if hits + misses else 0.0
+        return merged
+
+    def render(self):
+        '''Every worker's metrics in the Prometheus text format'''
+        merged = self.collect()
+        series, types = {}, {}
+        for kind, type in (("counters", "counter"), ("gauges", "gauge"), ("histograms", "histogram")):
+            for (name, labels), value in merged[kind].items():
+                series.setdefault(name, []).append((labels, value))
+                types[name] = type
+
+        lines = []
+        for name in sorted(series):
+            type, help = types[name], METRIC_TYPES.get(name, (None, name))[1]
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {type}"]
+            for labels, value in sorted(series[name], key=lambda item: item[0]):
+                if type != "histogram":
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+                    continue
+                for bound, count in zip(BUCKETS, value["buckets"]):
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {value['count']}")
+                lines.append(f"{name}_sum{format_labels(labels)} {value['sum']}")
+                lines.append(f"{name}_count{format_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+METRICS = Metrics(METRICS_DIR, METRICS_FLUSH)
+
+
+class TimedPool:
+    '''Pool mixin observing how long each checkout waited for a connection'''
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            METRICS.observe("db_pool_checkout_seconds", time.perf_counter() - start)
+
+
+def timed_pool_class(database_url, poolclass=None):
+    '''The pool class the engine would use (or poolclass), timing its checkouts'''
+    if poolclass is None:
+        url = make_url(database_url)
+        poolclass = url.get_dialect().get_pool_class(url)
+    return type(f"Timed{poolclass.__name__}", (TimedPool, poolclass), {})
+
+
+def setup_metrics(app):
+    '''
+    Record per-route request counts, latency and DB time
+    '''
+    from .profiling import query_stats
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        if "metrics_start" not in g:
+            return response
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        METRICS.inc("http_requests_total", method=request.method, route=route, status=str(response.status_code))
+        METRICS.observe("http_request_duration_seconds", time.perf_counter() - g.metrics_start,
+                        method=request.method, route=route)
+        count, seconds = query_stats()
+        METRICS.inc("db_queries_total", count, route=route)
+        METRICS.observe("db_request_seconds", seconds, route=route)
+        METRICS.flush()
+        return response
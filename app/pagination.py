@@ -0,0 +1,96 @@
+import json
+import base64
+from flask import request, abort
+from sqlalchemy import or_, and_, false
+from .config import PAGE_LIMIT, PAGE_LIMIT_MAX
+
+
+def encode_cursor(values):
+    '''Opaque cursor for a list of key values'''
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    '''Key values from an opaque cursor, aborts with 400 if it was tampered with'''
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        abort(400)
+    if not isinstance(values, list):
+        abort(400)
+    return values
+
+
+def page_args():
+    '''
+    Read limit and cursor from the query string
+    @RETURNS
+        (limit, key values or None)
+    '''
+    try:
+        limit = int(request.args.get("limit", PAGE_LIMIT))
+    except ValueError:
+        abort(400)
+    if limit < 1:
+        abort(400)
+    cursor = request.args.get("cursor")
+    return min(limit, PAGE_LIMIT_MAX), decode_cursor(cursor) if cursor else None
+
+
+def keyset_page(query, columns, limit, after=None):
+    '''
+    Keyset pagination: order by columns (the last one unique) and
+    return the rows strictly after the given key values
+    @INPUTS
+        query: query to paginate
+        columns: ordering columns, i.e. (Movie.title, Movie.id)
+        limit: page size
+        after: key values of the last row of the previous page
+    @RETURNS
+        (rows, next cursor or None)
+    '''
+    if after is not None:
+        check_key(columns, after)
+        query = query.filter(after_key(columns, after))
+
+    rows = query.order_by(*sort_order(columns)).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, c.key) for c in columns])
+
+
+def sort_order(columns):
+    '''Ascending order by columns, NULLs last on every database'''
+    return [column.nullslast() for column in columns]
+
+
+def check_key(columns, values):
+    '''Aborts with 400 unless the cursor key values fit the columns, one value of the column's type each'''
+    if len(values) != len(columns):
+        abort(400)
+    for column, value in zip(columns, values):
+        if value is None:
+            if not column.nullable:
+                abort(400)
+        elif isinstance(value, bool) or not isinstance(value, column.type.python_type):
+            abort(400)
+
+
+def after_key(columns, values):
+    '''
+    (c1, c2, ...) > (v1, v2, ...) in sort_order(), spelled out with OR / AND for portability:
+    NULLs sort after every value, and only a later NULL follows a NULL
+    '''
+    (column, *rest), (value, *rest_values) = columns, values
+    tail = after_key(rest, rest_values) if rest else false()
+    if value is None:
+        return and_(column.is_(None), tail)
+    after = or_(column > value, column.is_(None)) if column.nullable else column > value
+    if not rest:
+        return after
+    return or_(after, and_(column == value, tail))
@@ -0,0 +1,99 @@
+import time
+import logging
+from functools import wraps
+from flask import g, current_app, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    '''
+    A route ran more SQL statements than its declared budget
+    '''
+
+    def __init__(self, endpoint, budget, count):
+        super().__init__(f"{endpoint} ran {count} queries, over its budget of {budget}")
+        self.endpoint = endpoint
+        self.budget = budget
+        self.count = count
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    # statements run outside a request (CLI, startup) are not tracked
+    if has_app_context() and "query_stats" in g:
+        g.query_stats[0] += 1
+        g.query_stats[1] += elapsed
+
+
+@event.listens_for(Engine, "handle_error")
+def failed_query(context):
+    starts = context.connection.info.get("query_start") if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def query_stats():
+    '''(queries, seconds spent in them) of the current request so far'''
+    count, seconds = g.get("query_stats", (0, 0.0))
+    return count, seconds
+
+
+def query_budget(max_queries):
+    '''
+    Route decorator failing when the view runs more than max_queries statements:
+    raises QueryBudgetExceeded outside production, logs a warning in production.
+    Bodies streamed after the view returns are not counted.
+    @INPUTS
+        max_queries: statements the route may run, whatever the size of the data,
+            None for routes running one per chunk of their input (imports)
+    '''
+
+    def query_budget_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            before, _ = query_stats()
+            response = f(*args, **kwargs)
+            count = query_stats()[0] - before
+            if max_queries is not None and count > max_queries:
+                error = QueryBudgetExceeded(request.endpoint, max_queries, count)
+                if current_app.env != "production":
+                    raise error
+                logger.warning(str(error))
+            return response
+
+        wrapper.query_budget = max_queries
+        return wrapper
+
+    return query_budget_decorator
+
+
+def setup_profiling(app):
+    '''
+    Count queries and DB time per request, reported in X-Query-Count and
+    Server-Timing response headers outside production
+    '''
+
+    @app.before_request
+    def start_request():
+        g.query_stats = [0, 0.0]
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def add_timing_headers(response):
+        if app.env == "production" or "query_stats" not in g:
+            return response
+        count, seconds = query_stats()
+        total = time.perf_counter() - g.request_start
+        response.headers["X-Query-Count"] = str(count)
+        response.headers["Server-Timing"] = (
+            f'db;dur={seconds * 1000:.2f};desc="{count} queries", app;dur={total * 1000:.2f}')
+        return response
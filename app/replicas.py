@@ -0,0 +1,86 @@
+import time
+import itertools
+from functools import wraps
+from flask import request, current_app, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+from .models import db
+from .metrics import METRICS
+from .config import REPLICA_RETRY, REPLICA_STICKY
+
+# clients that just wrote carry this cookie for REPLICA_STICKY seconds and read from the primary
+STICKY_COOKIE = "db_primary"
+
+# replica bind -> monotonic time it may be tried again
+REPLICA_DOWN = {}
+_turn = itertools.count()
+
+
+def replica_binds(app):
+    return [bind for bind in app.config.get("SQLALCHEMY_BINDS") or {} if bind.startswith("replica")]
+
+
+def choose_replica(app):
+    '''Next replica not marked down, round robin, or None'''
+    now = time.monotonic()
+    healthy = [bind for bind in replica_binds(app) if REPLICA_DOWN.get(bind, 0) <= now]
+    if not healthy:
+        return None
+    return healthy[next(_turn) % len(healthy)]
+
+
+def replica_unreachable(error):
+    '''
+    Whether an OperationalError means the replica is out of reach: it could not be
+    connected to (no statement ran) or it dropped the connection. A statement that
+    failed on a working connection, i.e. cancelled by DB_STATEMENT_TIMEOUT, is not.
+    '''
+    return error.connection_invalidated or error.statement is None
+
+
+def read_replica(f):
+    '''
+    Route decorator running a read-only view on a replica, unless the client
+    just wrote (read-your-writes). When the replica cannot be reached it is
+    skipped for REPLICA_RETRY seconds and the view runs again on the primary;
+    other errors, statement timeouts included, propagate.
+    Streamed bodies read from the same replica, without failover.
+    '''
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        if request.cookies.get(STICKY_COOKIE):
+            return f(*args, **kwargs)
+        g.db_replica = choose_replica(current_app)
+        if g.db_replica is None:
+            return f(*args, **kwargs)
+        try:
+            return f(*args, **kwargs)
+        except OperationalError as error:
+            if not replica_unreachable(error):
+                raise
+            REPLICA_DOWN[g.db_replica] = time.monotonic() + REPLICA_RETRY
+            METRICS.inc("db_replica_failovers_total", replica=g.db_replica)
+            db.session.rollback()
+            g.db_replica = None
+            return f(*args, **kwargs)
+
+    return wrapper
+
+
+@event.listens_for(db.session, "after_commit")
+def remember_write(session):
+    if has_request_context():
+        g.db_wrote = True
+
+
+def setup_replicas(app):
+    '''
+    Stick clients that wrote to the primary for REPLICA_STICKY seconds
+    '''
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get("db_wrote") and replica_binds(app):
+            response.set_cookie(STICKY_COOKIE, "1", max_age=REPLICA_STICKY, httponly=True, samesite="Lax")
+        return response
@@ -0,0 +1,201 @@
+import re
+import hashlib
+import threading
+from functools import wraps
+from flask import request, make_response, Response, g
+from sqlalchemy import event
+from .cache import LRUCache
+from .config import RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, RESPONSE_CACHE_URL
+from .models import db
+from .streaming import wants_stream
+from .conditional import resource_etag
+from .metrics import METRICS
+
+
+class MemoryBackend:
+    '''
+    In-process LRU backend
+    '''
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.lru = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        return self.lru.get(key)
+
+    def set(self, key, value, tags):
+        self.lru.set(key, value)
+        with self._lock:
+            for tag in tags:
+                keys = self.tags.setdefault(tag, set())
+                keys.add(key)
+                if len(keys) > 2 * self.lru.maxsize:
+                    # forget keys the LRU already evicted
+                    keys.intersection_update(self.lru._data)
+
+    def invalidate(self, tag):
+        with self._lock:
+            keys = self.tags.pop(tag, set())
+        for key in keys:
+            self.lru.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self.tags.clear()
+        self.lru.clear()
+
+
+class RedisBackend:
+    '''
+    Out-of-process backend shared by all workers
+    @INPUTS
+        client: redis.Redis or anything with the same get/set/delete/sadd/smembers/expire/scan_iter
+        ttl: seconds entries, and the tag sets listing them, are kept
+    '''
+
+    # keys deleted per DEL by clear()
+    CLEAR_BATCH = 500
+
+    def __init__(self, client, ttl=None, prefix="capstone:responses:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, tags):
+        self.client.set(self.prefix + key, value, ex=self.ttl)
+        for tag in tags:
+            tag_key = self.prefix + "tag:" + tag
+            self.client.sadd(tag_key, key)
+            if self.ttl:
+                # outlives every entry it lists, so members of expired entries go with it
+                self.client.expire(tag_key, self.ttl)
+
+    def invalidate(self, tag):
+        tag_key = self.prefix + "tag:" + tag
+        keys = [self.prefix + key.decode() if isinstance(key, bytes) else self.prefix + key
+                for key in self.client.smembers(tag_key)]
+        self.client.delete(tag_key, *keys)
+
+    def clear(self):
+        '''Delete every key under the prefix, SCAN rather than KEYS not to block the server'''
+        pattern = re.sub(r"([*?\[\]\\])", r"\\\1", self.prefix) + "*"
+        batch = []
+        for key in self.client.scan_iter(match=pattern, count=self.CLEAR_BATCH):
+            batch.append(key)
+            if len(batch) >= self.CLEAR_BATCH:
+                self.client.delete(*batch)
+                batch = []
+        if batch:
+            self.client.delete(*batch)
+
+
+class ResponseCache:
+    '''
+    Cache of serialized response bodies, tagged by the tables they were built from
+        - keys hold the table versions, so entries written by a stale worker are never read
+        - commits that bumped a table version invalidate its entries
+    '''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        mimetype, _, body = value.partition(b"\n")
+        return mimetype.decode(), body
+
+    def set(self, key, mimetype, body, tags):
+        self.backend.set(key, mimetype.encode() + b"\n" + body, tags)
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.backend.invalidate(tag)
+
+    def clear(self):
+        self.backend.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def make_backend(url=RESPONSE_CACHE_URL):
+    '''Redis backend when RESPONSE_CACHE_URL is set, in-process LRU otherwise'''
+    if url:
+        import redis
+        return RedisBackend(redis.Redis.from_url(url), ttl=RESPONSE_CACHE_TTL)
+    return MemoryBackend(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+
+RESPONSE_CACHE = ResponseCache(make_backend())
+
+
+@METRICS.collector
+def response_cache_counters():
+    stats = RESPONSE_CACHE.stats()
+    return [
+        ("counter", "cache_hits_total", {"cache": "response"}, stats["hits"]),
+        ("counter", "cache_misses_total", {"cache": "response"}, stats["misses"]),
+    ]
+
+
+@event.listens_for(db.session, "after_commit")
+def invalidate_committed(session):
+    RESPONSE_CACHE.invalidate(*session.info.pop("bumped_versions", ()))
+
+
+@event.listens_for(db.session, "after_rollback")
+def forget_rolled_back(session):
+    session.info.pop("bumped_versions", None)
+
+
+def cache_key(resources, payload):
+    '''
+    Key from the resource versions (the ETag of the request, when already computed),
+    the caller's permission scope and the query string
+    '''
+    etag = g.get("etag") or resource_etag(resources, request.view_args.get("id"))
+    scope = ",".join(sorted(payload.get("permissions", [])))
+    raw = f"{request.path}|{etag}|{scope}|{request.query_string.decode()}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def cached(*resources):
+    '''
+    Response cache decorator for authenticated GETs, after requires_auth
+    @INPUTS
+        resources: table names the response is built from (and invalidated by)
+    '''
+
+    def cached_decorator(f):
+        @wraps(f)
+        def wrapper(payload, *args, **kwargs):
+            if wants_stream():
+                return f(payload, *args, **kwargs)
+
+            key = cache_key(resources, payload)
+            hit = RESPONSE_CACHE.get(key)
+            if hit is not None:
+                mimetype, body = hit
+                return Response(body, mimetype=mimetype)
+
+            response = make_response(f(payload, *args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                RESPONSE_CACHE.set(key, response.mimetype, response.get_data(), resources)
+            return response
+
+        return wrapper
+
+    return cached_decorator
@@ -1,14 +1,36 @@
 import os
-from flask import request, abort, jsonify, request, render_template
-from .config import BASE_URL
-from .models import Movie, Actor
-from .auth import requires_auth, login_url, logout_url, get_permissions
+import jsonschema
+from sqlalchemy.exc import IntegrityError
+from flask import request, abort, jsonify, request, render_template, Response, stream_with_context
+from .config import BASE_URL, FEED_MAX_AGE
+from .models import db, Movie, Actor, bulk_create, bulk_update, bulk_delete
+from .models import existing_ids, get_cast, change_cast, link_actors, get_versions, CHANGES
+from . import schemas
+from .auth import requires_auth, login_url, logout_url, get_permissions, check_permissions, AuthError
+from .pagination import page_args, encode_cursor, sort_order
+from .search import search_query, search_filter, search_catalog
+from .fieldsets import parse_fieldset
+from .serializers import list_page, json_response
+from .streaming import wants_stream, stream_listing
+from .conditional import conditional
+from .response_cache import cached
+from .profiling import query_budget
+from .metrics import METRICS
+from .health import TABLE_STATS, stats_etag, database_ready
+from .replicas import read_replica
+from .changes import changes_since, SYNCED
+from .feed import FEED, event_stream, max_streams
+from .catalog import KINDS, FORMATS, ImportFormatError, import_records, read_records
+from .catalog import EXPORTS, begin_snapshot, export_table, export_filename
 
 
 def setup_routes(app):
     '''Applies routes to app'''
+    # fail at startup rather than let /feed streams take every thread
+    max_streams(app.config)
 
     @app.route("/", methods=["GET"])
+    @query_budget(0)
     def index():
         data = {
             "appUrl": BASE_URL,
@@ -19,42 +41,224 @@ def setup_routes(app):
         return render_template("index.html", **data)
 
     @app.route("/health", methods=["GET"])
+    @read_replica
+    @query_budget(2)
     def healthcheck():
-        data = {
-            "status": "Healthy",
-            "movies": Movie.query.count(),
-            "actors": Actor.query.count(),
-        }
-        return jsonify(data)
+        '''GET /health - Status and row counts, refreshed every STATS_TTL seconds'''
+        # validated against the cached counts it sends, not the live table versions
+        stats = TABLE_STATS.get()
+        etag = stats_etag(stats)
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = jsonify({"status": "Healthy", **stats})
+        response.set_etag(etag, weak=True)
+        return response
+
+    @app.route("/health/live", methods=["GET"])
+    @query_budget(0)
+    def liveness():
+        '''GET /health/live - The process serves requests, no DB work'''
+        return jsonify({"status": "Alive"})
+
+    @app.route("/health/ready", methods=["GET"])
+    @query_budget(0)
+    def readiness():
+        '''GET /health/ready - The database answers SELECT 1 within READY_TIMEOUT seconds'''
+        if not database_ready(db.engine):
+            return jsonify({"status": "Unavailable"}), 503
+        return jsonify({"status": "Ready"})
 
     @app.route("/user", methods=["GET"])
+    @query_budget(0)
     @requires_auth()
     def get_user(jwt):
         return jsonify({"permissions": get_permissions()})
 
+    @app.route("/metrics", methods=["GET"])
+    @query_budget(0)
+    @requires_auth("metrics:read")
+    def metrics(jwt):
+        '''GET /metrics - Prometheus metrics of every worker'''
+        return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
+    @app.route("/search", methods=["GET"])
+    @read_replica
+    @query_budget(5)
+    @requires_auth()
+    @conditional("movies", "actors", scoped=True)
+    def search(jwt):
+        '''GET /search?q= - Movies and actors matching q, best match first'''
+        q = search_query()
+        if q is None:
+            abort(400)
+
+        permissions = jwt.get("permissions", [])
+        types = [type for type in ("movie", "actor") if f"{type}s:list" in permissions]
+        if not types:
+            raise AuthError("Permission not found.", 401)
+
+        limit, after = page_args()
+        offset = after[0] if after else 0
+        if not isinstance(offset, int) or offset < 0:
+            abort(400)
+
+        results, more = search_catalog(q, types, offset, limit)
+        return jsonify({"results": results, "next": encode_cursor([offset + limit]) if more else None})
+
+    @app.route("/changes", methods=["GET"])
+    @read_replica
+    @query_budget(10)
+    @requires_auth()
+    @conditional("changes", scoped=True)
+    def changes(jwt):
+        '''GET /changes?since= - Movies, actors and cast links written after change since'''
+        try:
+            since = int(request.args.get("since", 0))
+        except ValueError:
+            abort(400)
+        if since < 0:
+            abort(400)
+
+        permissions = jwt.get("permissions", [])
+        tables = [table for table, permission in SYNCED.items() if permission in permissions]
+        if not tables:
+            raise AuthError("Permission not found.", 401)
+
+        limit, _ = page_args()
+        changes = changes_since(since, limit, tables)
+        if changes is None:
+            abort(400)
+        return json_response(changes)
+
+    @app.route("/feed", methods=["GET"])
+    @query_budget(1)
+    @requires_auth()
+    def feed(jwt):
+        '''GET /feed - Server-sent events of the changes after Last-Event-ID (or since, or now)'''
+        permissions = jwt.get("permissions", [])
+        tables = [table for table, permission in SYNCED.items() if permission in permissions]
+        if not tables:
+            raise AuthError("Permission not found.", 401)
+
+        (head,) = get_versions(CHANGES)
+        try:
+            since = int(request.headers.get("Last-Event-ID") or request.args.get("since", head))
+        except ValueError:
+            abort(400)
+        if since < 0:
+            abort(400)
+        # streams hold no connection while they wait
+        db.session.close()
+
+        # counted until the server closes the response, even one whose body never started
+        if not FEED.open_stream(max_streams(app.config)):
+            abort(503)
+        FEED.start(app)
+        # a client ahead of the database (restored from a backup) follows it from its head
+        stream = event_stream(FEED, min(since, head), tables, app.config.get("FEED_MAX_AGE", FEED_MAX_AGE))
+        response = Response(stream_with_context(stream), mimetype="text/event-stream")
+        response.call_on_close(FEED.close_stream)
+        response.headers["Cache-Control"] = "no-cache"
+        # nginx would buffer the stream otherwise
+        response.headers["X-Accel-Buffering"] = "no"
+        return response
+
+    @app.route("/import/<kind>", methods=["POST"])
+    @query_budget(None)
+    @requires_auth()
+    def import_catalog(jwt, kind):
+        '''POST /import/:kind - Import a CSV or NDJSON body of movies, actors or cast links'''
+        if kind not in KINDS:
+            abort(404)
+        for permission in KINDS[kind].permissions:
+            check_permissions(permission, jwt)
+        formats = {mimetype: format for format, mimetype in FORMATS.items()}
+        if request.mimetype not in formats:
+            abort(400)
+
+        try:
+            report = import_records(kind, read_records(request.stream, formats[request.mimetype]))
+        except ImportFormatError:
+            abort(400)
+        return jsonify(report)
+
+    @app.route("/export/<table>", methods=["GET"])
+    @read_replica
+    @query_budget(3)
+    @requires_auth()
+    def export_catalog(jwt, table):
+        '''GET /export/:table - Stream every movie, actor or cast link as CSV or NDJSON'''
+        if table not in EXPORTS:
+            abort(404)
+        for permission in EXPORTS[table].permissions:
+            check_permissions(permission, jwt)
+        format = request.args.get("format", "csv")
+        if format not in FORMATS:
+            abort(400)
+        compress = request.args.get("gzip") == "1"
+
+        seq = begin_snapshot()
+        body = export_table(table, format, compress)
+        response = Response(stream_with_context(body), mimetype="application/gzip" if compress else FORMATS[format])
+        response.headers["Content-Disposition"] = f"attachment; filename={export_filename(table, format, compress)}"
+        response.headers["X-Change-Seq"] = str(seq)
+        return response
+
     # ------------------------------------------------------------
     # Movies
     @app.route("/movies", methods=["GET"])
+    @read_replica
+    @query_budget(6)
     @requires_auth("movies:list")
+    @conditional("movies")
+    @cached("movies")
     def get_movies(jwt):
-        '''GET /movies - List all movies'''
-        movies = Movie.query.order_by(Movie.title).all()
-        return jsonify({"movies": [m.data() for m in movies]})
+        '''GET /movies - List movies a page at a time, ordered by title'''
+        fieldset = parse_fieldset(Movie)
+        q = search_query()
+        where = search_filter(Movie, Movie.title, q) if q else None
+
+        if wants_stream():
+            query = Movie.streaming(fieldset)
+            if where is not None:
+                query = query.filter(where)
+            query = query.order_by(*sort_order((Movie.title, Movie.id)))
+            return stream_listing(query, "movies", lambda movie: movie.data(fieldset))
+
+        limit, after = page_args()
+        movies, cursor = list_page(Movie, fieldset, where, limit, after)
+        return json_response({"movies": movies, "next": cursor})
+
+    @app.route("/movies/<int:id>", methods=["GET"])
+    @read_replica
+    @query_budget(4)
+    @requires_auth("movies:list")
+    @conditional("movies")
+    def get_movie(jwt, id):
+        '''GET /movies/:id - Get a movie'''
+        fieldset = parse_fieldset(Movie)
+        movie = Movie.find(id, fieldset)
+        if movie is None:
+            abort(404)
+
+        return jsonify({"movie": movie.data(fieldset)})
 
     @app.route("/movies", methods=["POST"])
+    @query_budget(6)
     @requires_auth("movies:create")
     def add_movie(jwt):
         '''POST /movies - Create new movie'''
         data = request.get_json(force=True)
-        exists = Movie.query.filter(Movie.title == data["title"]).count()
-        if exists:
-            abort(405)
-
         movie = Movie(**data)
-        movie.insert()
+        try:
+            movie.insert()
+        except IntegrityError:
+            abort(405)
         return jsonify({"movie": movie.data()})
 
     @app.route("/movies/<int:id>", methods=["PATCH"])
+    @query_budget(9)
     @requires_auth("movies:update")
     def update_movie(jwt, id):
         '''PATCH /movies/:id - Update a movie'''
@@ -66,26 +270,57 @@ def setup_routes(app):
         movie.title = data.get("title", movie.title)
         movie.release_date = data.get("release_date", movie.release_date)
         movie.update()
-        return jsonify({"movie": movie.data()})
+        return jsonify({"movie": Movie.find(id).data()})
 
     @app.route('/movies/<int:id>', methods=["DELETE"])
+    @query_budget(7)
     @requires_auth("movies:delete")
     def delete_movie(jwt, id):
         '''DELETE /movies/:id - Delete a movie'''
-        movie = Movie.query.get(id)
+        movie = Movie.find(id)
         if movie is None:
             abort(404)
 
+        deleted = movie.data()
         movie.delete()
-        return jsonify({"deleted": movie.data()})
+        return jsonify({"deleted": deleted})
+
+    @app.route("/movies/bulk", methods=["POST"])
+    @query_budget(6)
+    @requires_auth("movies:create")
+    def add_movies(jwt):
+        '''POST /movies/bulk - Create many movies, skipping duplicate titles'''
+        data = request.get_json(force=True)
+        jsonschema.validate(data, schemas.movies_bulk.create)
+        results = bulk_create(Movie, "title", data["movies"], "movie", {"actors": []})
+        return jsonify({"results": results})
+
+    @app.route("/movies/bulk", methods=["PATCH"])
+    @query_budget(6)
+    @requires_auth("movies:update")
+    def update_movies(jwt):
+        '''PATCH /movies/bulk - Update many movies, skipping duplicate titles'''
+        data = request.get_json(force=True)
+        jsonschema.validate(data, schemas.movies_bulk.update)
+        return jsonify({"results": bulk_update(Movie, "title", data["movies"], ["actors"])})
+
+    @app.route("/movies/bulk", methods=["DELETE"])
+    @query_budget(7)
+    @requires_auth("movies:delete")
+    def delete_movies(jwt):
+        '''DELETE /movies/bulk - Delete many movies'''
+        data = request.get_json(force=True)
+        jsonschema.validate(data, schemas.movies_bulk.delete)
+        return jsonify({"results": bulk_delete(Movie, data["ids"], ["actors"])})
 
     # ------------------------------------------------------------
     # Movie Actors
     @app.route("/movies/<int:id>/actors", methods=["POST"])
+    @query_budget(12)
     @requires_auth("movies:update")
     def add_movie_actor(jwt, id):
         '''POST /movies/:id/actors - Add an actor to a movie'''
-        movie = Movie.query.get(id)
+        movie = Movie.find(id)
         if movie is None:
             abort(404)
 
@@ -97,13 +332,14 @@ def setup_routes(app):
         movie.actors.append(actor)
         movie.update()
 
-        return jsonify({"movie": movie.data()})
+        return jsonify({"movie": Movie.find(id).data()})
 
     @app.route("/movies/<int:id>/actors", methods=["DELETE"])
+    @query_budget(11)
     @requires_auth("movies:update")
     def delete_movie_actor(jwt, id):
         '''DELETE /movies/:id/actors - Remove an actor from a movie'''
-        movie = Movie.query.get(id)
+        movie = Movie.find(id)
         if movie is None:
             abort(404)
 
@@ -115,32 +351,120 @@ def setup_routes(app):
         movie.actors.remove(actor)
         movie.update()
 
-        return jsonify({"movie": movie.data()})
+        return jsonify({"movie": Movie.find(id).data()})
+
+    @app.route("/movies/<int:id>/actors", methods=["PUT"])
+    @query_budget(11)
+    @requires_auth("movies:update")
+    def set_movie_actors(jwt, id):
+        '''PUT /movies/:id/actors - Replace the cast of a movie'''
+        data = request.get_json(force=True)
+        jsonschema.validate(data, schemas.cast.set)
+        if not existing_ids(Movie, [id]):
+            abort(404)
+
+        wanted = set(data["actors"])
+        if wanted and existing_ids(Actor, wanted) != wanted:
+            abort(404)
+
+        current = get_cast(id)
+        added, removed = wanted - current, current - wanted
+        change_cast(id, add=added, remove=removed)
+        return jsonify({"movie": {"id": id, "actors": sorted(wanted)}, "added": sorted(added), "removed": sorted(removed)})
+
+    @app.route("/movies/<int:id>/actors", methods=["PATCH"])
+    @query_budget(11)
+    @requires_auth("movies:update")
+    def change_movie_actors(jwt, id):
+        '''PATCH /movies/:id/actors - Add and remove actors of a movie'''
+        data = request.get_json(force=True)
+        jsonschema.validate(data, schemas.cast.change)
+        if not existing_ids(Movie, [id]):
+            abort(404)
+
+        add, remove = set(data.get("add", [])), set(data.get("remove", []))
+        if add and existing_ids(Actor, add) != add:
+            abort(404)
+
+        cast = change_cast(id, add=add, remove=remove - add)
+        return jsonify({"movie": {"id": id, "actors": sorted(cast)}})
+
+    @app.route("/movie-actors", methods=["POST"])
+    @query_budget(7)
+    @requires_auth("movies:update")
+    def add_movie_actor_links(jwt):
+        '''POST /movie-actors - Link many (movie, actor) pairs'''
+        data = request.get_json(force=True)
+        jsonschema.validate(data, schemas.cast.links)
+        links = data["links"]
+        movies = existing_ids(Movie, [link["movie_id"] for link in links])
+        actors = existing_ids(Actor, [link["actor_id"] for link in links])
+
+        pairs, not_found = set(), []
+        for index, link in enumerate(links):
+            if link["movie_id"] in movies and link["actor_id"] in actors:
+                pairs.add((link["movie_id"], link["actor_id"]))
+            else:
+                not_found.append({"index": index, **link})
+
+        link_actors(pairs)
+        return jsonify({"linked": len(pairs), "not_found": not_found})
 
     # ------------------------------------------------------------
     # Actors
 
     @app.route("/actors", methods=["GET"])
+    @read_replica
+    @query_budget(5)
     @requires_auth("actors:list")
+    @conditional("actors")
+    @cached("actors")
     def get_actors(jwt):
-        '''GET /actors - List all actors'''
-        actors = Actor.query.order_by(Actor.name).all()
-        return jsonify({"actors": [a.data() for a in actors]})
+        '''GET /actors - List actors a page at a time, ordered by name'''
+        fieldset = parse_fieldset(Actor)
+        q = search_query()
+        where = search_filter(Actor, Actor.name, q) if q else None
+
+        if wants_stream():
+            query = Actor.streaming(fieldset)
+            if where is not None:
+                query = query.filter(where)
+            query = query.order_by(*sort_order((Actor.name, Actor.id)))
+            return stream_listing(query, "actors", lambda actor: actor.data(fieldset))
+
+        limit, after = page_args()
+        actors, cursor = list_page(Actor, fieldset, where, limit, after)
+        return json_response({"actors": actors, "next": cursor})
+
+    @app.route("/actors/<int:id>", methods=["GET"])
+    @read_replica
+    @query_budget(3)
+    @requires_auth("actors:list")
+    @conditional("actors")
+    def get_actor(jwt, id):
+        '''GET /actors/:id - Get an actor'''
+        fieldset = parse_fieldset(Actor)
+        actor = Actor.find(id, fieldset)
+        if actor is None:
+            abort(404)
+
+        return jsonify({"actor": actor.data(fieldset)})
 
     @app.route("/actors", methods=["POST"])
+    @query_budget(6)
     @requires_auth("actors:create")
     def add_actor(jwt):
         '''POST /actors - Create a new actor'''
         data = request.get_json(force=True)
-        exists = Actor.query.filter(Actor.name == data["name"]).count()
-        if exists:
-            abort(405)
-
         actor = Actor(**data)
-        actor.insert()
+        try:
+            actor.insert()
+        except IntegrityError:
+            abort(405)
         return jsonify({"actor": actor.data()})
 
     @app.route("/actors/<int:id>", methods=["PATCH"])
+    @query_budget(8)
     @requires_auth("actors:update")
     def update_actor(jwt, id):
         '''PATCH /actors/:id - Update an actor'''
@@ -153,15 +477,45 @@ def setup_routes(app):
         actor.age = data.get("age", actor.age)
         actor.gender = data.get("gender", actor.gender)
         actor.update()
-        return jsonify({"actor": actor.data()})
+        return jsonify({"actor": Actor.find(id).data()})
 
     @app.route("/actors/<int:id>", methods=["DELETE"])
+    @query_budget(7)
     @requires_auth("actors:delete")
     def delete_actor(jwt, id):
         '''DELETE /actors/:id - Delete an actor'''
-        actor = Actor.query.get(id)
+        actor = Actor.find(id)
         if actor is None:
             abort(404)
 
+        deleted = actor.data()
         actor.delete()
-        return jsonify({"deleted": actor.data()})
+        return jsonify({"deleted": deleted})
+
+    @app.route("/actors/bulk", methods=["POST"])
+    @query_budget(6)
+    @requires_auth("actors:create")
+    def add_actors(jwt):
+        '''POST /actors/bulk - Create many actors, skipping duplicate names'''
+        data = request.get_json(force=True)
+        jsonschema.validate(data, schemas.actors_bulk.create)
+        results = bulk_create(Actor, "name", data["actors"], "actor", {"movies": []})
+        return jsonify({"results": results})
+
+    @app.route("/actors/bulk", methods=["PATCH"])
+    @query_budget(6)
+    @requires_auth("actors:update")
+    def update_actors(jwt):
+        '''PATCH /actors/bulk - Update many actors, skipping duplicate names'''
+        data = request.get_json(force=True)
+        jsonschema.validate(data, schemas.actors_bulk.update)
+        return jsonify({"results": bulk_update(Actor, "name", data["actors"], ["movies"])})
+
+    @app.route("/actors/bulk", methods=["DELETE"])
+    @query_budget(7)
+    @requires_auth("actors:delete")
+    def delete_actors(jwt):
+        '''DELETE /actors/bulk - Delete many actors'''
+        data = request.get_json(force=True)
+        jsonschema.validate(data, schemas.actors_bulk.delete)
+        return jsonify({"results": bulk_delete(Actor, data["ids"], ["movies"])})
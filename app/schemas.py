@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+from .config import BULK_LIMIT
+
+
+def bulk_of(item, max_items=BULK_LIMIT):
+    return {"type": "array", "minItems": 1, "maxItems": max_items, "items": item}
+
+
+ids = {"type": "array", "minItems": 1, "maxItems": BULK_LIMIT, "items": {"type": "integer"}}
+
+movie_fields = {
+    "title": {"type": "string", "minLength": 1},
+    "release_date": {"type": "string"},
+}
+
+movie = SimpleNamespace(
+    create={
+        "type": "object",
+        "properties": movie_fields,
+        "required": ["title", "release_date"],
+        "additionalProperties": False,
+    },
+    update={
+        "type": "object",
+        "properties": {"id": {"type": "integer"}, **movie_fields},
+        "additionalProperties": False,
+    },
+)
+
+actor_fields = {
+    "name": {"type": "string", "minLength": 1},
+    "age": {"type": "integer", "minimum": 0, "maximum": 120},
+    "gender": {"enum": ["M", "F", "X"]},
+}
+
+actor = SimpleNamespace(
+    create={
+        "type": "object",
+        "properties": actor_fields,
+        "required": ["name", "age", "gender"],
+        "additionalProperties": False,
+    },
+    update={
+        "type": "object",
+        "properties": {"id": {"type": "integer"}, **actor_fields},
+        "additionalProperties": False,
+    },
+)
+
+movies_bulk = SimpleNamespace(
+    create={"type": "object", "properties": {"movies": bulk_of(movie.create)}, "required": ["movies"]},
+    update={
+        "type": "object",
+        "properties": {"movies": bulk_of({**movie.update, "required": ["id"]})},
+        "required": ["movies"],
+    },
+    delete={"type": "object", "properties": {"ids": ids}, "required": ["ids"]},
+)
+
+actors_bulk = SimpleNamespace(
+    create={"type": "object", "properties": {"actors": bulk_of(actor.create)}, "required": ["actors"]},
+    update={
+        "type": "object",
+        "properties": {"actors": bulk_of({**actor.update, "required": ["id"]})},
+        "required": ["actors"],
+    },
+    delete={"type": "object", "properties": {"ids": ids}, "required": ["ids"]},
+)
+
+cast = SimpleNamespace(
+    set={"type": "object", "properties": {"actors": {**ids, "minItems": 0}}, "required": ["actors"]},
+    change={
+        "type": "object",
+        "properties": {"add": {**ids, "minItems": 0}, "remove": {**ids, "minItems": 0}},
+        "additionalProperties": False,
+    },
+    links={
+        "type": "object",
+        "properties": {
+            "links": bulk_of({
+                "type": "object",
+                "properties": {"movie_id": {"type": "integer"}, "actor_id": {"type": "integer"}},
+                "required": ["movie_id", "actor_id"],
+                "additionalProperties": False,
+            }),
+        },
+        "required": ["links"],
+    },
+    # a cast link by natural keys, as imported from studio catalogs
+    by_name={
+        "type": "object",
+        "properties": {"title": movie_fields["title"], "name": actor_fields["name"]},
+        "required": ["title", "name"],
+    },
+)
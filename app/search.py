@@ -0,0 +1,184 @@
+import re
+import sqlite3
+from flask import request
+from sqlalchemy import or_, and_, func, event
+from sqlalchemy.engine import Engine
+from .models import db, Movie, Actor, get_versions
+from .cache import LRUCache
+from .config import SEARCH_THRESHOLD, SEARCH_MAX
+
+WORD = re.compile(r"\w+")
+WORD3 = re.compile(r"^\w{3}$")
+
+
+def trigrams(text):
+    '''Trigrams of each word, padded like pg_trgm does ("  w", " wo", "wor", "ord", "rd ")'''
+    grams = set()
+    for word in WORD.findall((text or "").lower()):
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    '''pg_trgm similarity: shared trigrams over distinct trigrams'''
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class TrigramIndex:
+    '''
+    In-memory inverted index of trigram -> ids over one text column,
+    used where pg_trgm is not available (SQLite).
+    Rebuilt when the table version changes.
+    '''
+
+    def __init__(self, model, column):
+        self.model = model
+        self.column = column
+        self.version = None
+        self.snapshot = ({}, {}, LRUCache(maxsize=128))
+
+    def refresh(self):
+        (version,) = get_versions(self.model.__tablename__)
+        if version == self.version:
+            return
+        postings, labels = {}, {}
+        for id, label in db.session.query(self.model.id, self.column):
+            labels[id] = (label, trigrams(label))
+            for gram in labels[id][1]:
+                postings.setdefault(gram, set()).add(id)
+        # matches of recent queries, for ?q= list pages (see matches)
+        self.snapshot, self.version = (postings, labels, LRUCache(maxsize=128)), version
+
+    def hits(self, q):
+        '''Every match for q in the current snapshot: [(score, id, label)], unordered'''
+        postings, labels, _ = self.snapshot
+        grams = trigrams(q)
+        needle = q.lower()
+        candidates = set().union(*(postings.get(gram, ()) for gram in grams))
+        # labels holding q as a substring hold every in-word trigram of q
+        inner = {needle[i:i + 3] for i in range(len(needle) - 2)}
+        inner = {gram for gram in inner if WORD3.match(gram)}
+        if inner:
+            candidates |= set.intersection(*(postings.get(gram, set()) for gram in inner))
+        else:
+            candidates = labels.keys()
+        hits = []
+        for id in candidates:
+            label, label_grams = labels[id]
+            score = similarity(grams, label_grams)
+            if score >= SEARCH_THRESHOLD or needle in (label or "").lower():
+                hits.append((score, id, label))
+        return hits
+
+    def search(self, q, limit):
+        '''
+        Ranked matches for q
+        @RETURNS
+            [(score, id, label)] best first, at most limit
+        '''
+        self.refresh()
+        hits = self.hits(q)
+        hits.sort(key=lambda hit: (-hit[0], hit[1]))
+        return hits[:limit]
+
+    def matches(self, q):
+        '''Ids of every match for q in the current snapshot, unranked and unbounded'''
+        memo = self.snapshot[2]
+        ids = memo.get(q)
+        if ids is None:
+            ids = frozenset(id for _, id, _ in self.hits(q))
+            memo.set(q, ids)
+        return ids
+
+
+INDEXES = {
+    Movie: TrigramIndex(Movie, Movie.title),
+    Actor: TrigramIndex(Actor, Actor.name),
+}
+TABLE_INDEXES = {model.__tablename__: index for model, index in INDEXES.items()}
+
+
+def trigram_match(table, q, id):
+    '''SQLite function behind search_filter: whether row id of table matches q'''
+    return id in TABLE_INDEXES[table].matches(q)
+
+
+@event.listens_for(Engine, "connect")
+def register_trigram_match(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function("trigram_match", 3, trigram_match, deterministic=True)
+
+
+def escape_like(q):
+    '''q matched literally by LIKE / ILIKE with a backslash escape'''
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def is_postgres():
+    return db.session.get_bind().dialect.name == "postgresql"
+
+
+def search_query():
+    '''The ?q= search string, or None'''
+    q = request.args.get("q", "").strip()
+    return q or None
+
+
+def search_filter(model, column, q):
+    '''
+    Where clause matching q, similar by at least SEARCH_THRESHOLD or holding q:
+        - Postgres: pg_trgm % (written %% for psycopg2) and ILIKE, both served by the
+          gin_trgm_ops index, % picking candidates at pg_trgm.similarity_threshold
+          (0.3 by default, keep it at most SEARCH_THRESHOLD) and similarity() applying ours
+        - elsewhere: every match of the in-memory trigram index, through trigram_match
+    '''
+    if is_postgres():
+        similar = and_(column.op("%%")(q), func.similarity(column, q) >= SEARCH_THRESHOLD)
+        return or_(similar, column.ilike(f"%{escape_like(q)}%", escape="\\"))
+    INDEXES[model].refresh()
+    return func.trigram_match(model.__tablename__, q, model.id)
+
+
+def search(model, column, q, limit):
+    '''
+    Ranked matches of q over one column
+    @RETURNS
+        [(score, id, label)] best first, at most limit
+    '''
+    if not is_postgres():
+        return INDEXES[model].search(q, limit)
+
+    score = func.similarity(column, q).label("score")
+    rows = (
+        db.session.query(score, model.id, column)
+        .filter(search_filter(model, column, q))
+        .order_by(score.desc(), model.id)
+        .limit(limit)
+    )
+    return [(float(s), id, label) for s, id, label in rows]
+
+
+def search_catalog(q, types, offset, limit):
+    '''
+    Movies and actors matching q, ranked together
+    @INPUTS
+        q: search string
+        types: subset of ("movie", "actor") the caller may list
+        offset, limit: page of the ranking
+    @RETURNS
+        (page of { type, id, title | name, score }, whether more results follow)
+    '''
+    sources = {"movie": (Movie, Movie.title, "title"), "actor": (Actor, Actor.name, "name")}
+    wanted = min(offset + limit + 1, SEARCH_MAX)
+    hits = []
+    for type in types:
+        model, column, field = sources[type]
+        hits += [
+            {"type": type, "id": id, field: label, "score": round(score, 3)}
+            for score, id, label in search(model, column, q, wanted)
+        ]
+    hits.sort(key=lambda hit: (-hit["score"], hit["type"], hit["id"]))
+    return hits[offset:offset + limit], len(hits) > offset + limit and offset + limit < SEARCH_MAX
@@ -0,0 +1,110 @@
+import json
+from flask import Response
+from sqlalchemy import select
+from .models import db, movie_actors
+from .pagination import after_key, check_key, encode_cursor, sort_order
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+# (model table, relationship) -> (link column to the model, link column to the related table)
+LINKS = {
+    ("movies", "actors"): (movie_actors.c.movie_id, movie_actors.c.actor_id),
+    ("actors", "movies"): (movie_actors.c.actor_id, movie_actors.c.movie_id),
+}
+
+
+def dumps(data):
+    '''JSON bytes, through orjson when installed'''
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def json_response(data):
+    return Response(dumps(data), mimetype="application/json")
+
+
+def full_fieldset(model):
+    '''What data() returns without a fieldset: every field and the default relationships'''
+    return model.FIELDS, model.RELATIONS
+
+
+def list_page(model, fieldset=None, where=None, limit=50, after=None):
+    '''
+    One keyset page of a list endpoint, as plain dicts, without the ORM:
+    a Core select of only the serialized columns, then one select per
+    embedded relationship level, rows zipped straight into dicts.
+    @INPUTS
+        model: Movie | Actor
+        fieldset: Fieldset, None for the full data() representation
+        where: extra where clause, i.e. a search filter
+        limit: page size
+        after: key values of the last row of the previous page
+    @RETURNS
+        (list of dicts, next cursor or None)
+    '''
+    fields, relations = fieldset if fieldset is not None else full_fieldset(model)
+    table = model.__table__
+    sort = (table.c[model.SORT_KEY], table.c.id)
+    extra = [column for column in sort if column.key not in fields]
+
+    query = select([table.c[field] for field in fields] + extra)
+    if where is not None:
+        query = query.where(where)
+    if after is not None:
+        check_key(sort, after)
+        query = query.where(after_key(sort, after))
+    rows = db.session.execute(query.order_by(*sort_order(sort)).limit(limit + 1)).fetchall()
+
+    cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        cursor = encode_cursor([rows[-1][column.key] for column in sort])
+
+    width = len(fields)
+    records = [dict(zip(fields, row[:width])) for row in rows]
+    attach(model, records, relations)
+    return records, cursor
+
+
+def attach(model, records, relations):
+    '''
+    Embed relationships into records, one select per relationship
+    @INPUTS
+        model: model the records are of
+        records: dicts holding at least an id
+        relations: relationship name -> nested fields, or None for the related model's full data()
+    '''
+    if not records or not relations:
+        return
+
+    ids = [record["id"] for record in records]
+    for name, nested in relations.items():
+        target = getattr(model, name).property.mapper.class_
+        local, remote = LINKS[(model.__tablename__, name)]
+        target_table = target.__table__
+        fields = target.FIELDS if nested is None else tuple(dict.fromkeys(("id",) + tuple(nested)))
+
+        query = (
+            select([local] + [target_table.c[field] for field in fields])
+            .select_from(movie_actors.join(target_table, remote == target_table.c.id))
+            .where(local.in_(ids))
+            .order_by(local, target_table.c[target.SORT_KEY])
+        )
+        related, by_owner = {}, {id: [] for id in ids}
+        for row in db.session.execute(query):
+            item = related.get(row[1])
+            if item is None:
+                item = related[row[1]] = dict(zip(fields, row[1:]))
+            by_owner[row[0]].append(item)
+
+        if nested is None:
+            attach(target, list(related.values()), target.RELATIONS)
+        for record in records:
+            record[name] = by_owner[record["id"]]
+        if nested is not None and "id" not in nested:
+            for item in related.values():
+                item.pop("id")
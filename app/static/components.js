@@ -3,31 +3,79 @@ import { html, render, Component } from 'https://unpkg.com/htm/preact/standalone
 const API = {
   token: null,
   base: null,
+  etags: {},
   init: (apiUrl, token) => {
     API.base = apiUrl;
     API.token = token;
   },
   call: async (url, method = 'GET', data) => {
-    const headers = { ...(API.token && { Authorization: `Bearer ${API.token}` }) };
+    const cached = method === 'GET' && API.etags[url];
+    const headers = {
+      ...(API.token && { Authorization: `Bearer ${API.token}` }),
+      ...(cached && { 'If-None-Match': cached.etag }),
+    };
     const body = data ? JSON.stringify(data) : undefined;
     const r = await fetch(API.base + url, { method, headers, body }).catch(err => ({ json: () => err }));
+    if (cached && r.status === 304) return cached.json;
     if (!r.ok) throw r.json();
-    return r.json();
+    const json = await r.json();
+    const etag = r.headers && r.headers.get('ETag');
+    if (method === 'GET' && etag) API.etags[url] = { etag, json };
+    return json;
   },
   post: async (url, data) => API.call(url, 'POST', data),
   patch: async (url, data) => API.call(url, 'PATCH', data),
   delete: async (url, data) => API.call(url, 'DELETE', data).catch(() => null),
   getPermissions: () => API.call('/user').then(({ permissions }) => permissions),
-  getMovies: () => API.call('/movies').then(({ movies }) => movies),
+  page: (cursor, q) => {
+    const params = new URLSearchParams({ ...(cursor && { cursor }), ...(q && { q }) }).toString();
+    return params ? `?${params}` : '';
+  },
+  getMovies: (cursor, q) => API.call('/movies' + API.page(cursor, q)),
   createMovie: data => API.post('/movies', data).then(({ movie }) => movie),
   updateMovie: movie => API.patch(`/movies/${movie.id}`, movie).then(({ movie }) => movie),
   deleteMovie: movie => API.delete(`/movies/${movie.id}`),
-  getActors: () => API.call('/actors').then(({ actors }) => actors),
+  getActors: (cursor, q) => API.call('/actors' + API.page(cursor, q)),
   createActor: data => API.post('/actors', data).then(({ actor }) => actor),
   updateActor: actor => API.patch(`/actors/${actor.id}`, actor).then(({ actor }) => actor),
   deleteActor: actor => API.delete(`/actors/${actor.id}`),
   addMovieActor: (movie, actor) => API.post(`/movies/${movie.id}/actors`, { actor }),
   removeMovieActor: (movie, actor) => API.delete(`/movies/${movie.id}/actors`, { actor }),
+  // server-sent change events, read with fetch to send the token; reconnects after the last event
+  feed: async (onChange, lastId) => {
+    const headers = { Authorization: `Bearer ${API.token}`, ...(lastId && { 'Last-Event-ID': lastId }) };
+    let retry = 3000;
+    try {
+      const r = await fetch(API.base + '/feed', { headers });
+      if (!r.ok) throw r;
+      const reader = r.body.pipeThrough(new TextDecoderStream()).getReader();
+      let buffer = '';
+      for (let chunk = await reader.read(); !chunk.done; chunk = await reader.read()) {
+        const messages = (buffer + chunk.value).split('\n\n');
+        buffer = messages.pop();
+        messages.forEach(message => {
+          const fields = Object.fromEntries(message.split('\n').filter(l => !l.startsWith(':')).map(l => l.split(/: (.*)/s)));
+          if (fields.retry) retry = Number(fields.retry);
+          if (fields.id) lastId = fields.id;
+          if (fields.event === 'change') onChange(JSON.parse(fields.data));
+        });
+      }
+    } catch (err) {
+      if (err.status === 401) return;
+    }
+    setTimeout(() => API.feed(onChange, lastId), retry);
+  },
+};
+
+// the first `pages` pages of a list, following the cursors: { items, next }
+const loadPages = async (get, key, pages) => {
+  const loaded = { items: [], next: null };
+  for (let page = 0; page < pages && (page === 0 || loaded.next); page++) {
+    const data = await get(loaded.next);
+    loaded.items = [...loaded.items, ...data[key]];
+    loaded.next = data.next;
+  }
+  return loaded;
 };
 
 const getHashToken = url => {
@@ -62,6 +110,8 @@ const AppHeader = ({ store }) => {
   </header>`;
 };
 
+const MoreBtn = ({ next, onClick }) => next && html`<li class="none"><${Btn} class="small" text="Load more" onClick="${onClick}" /></li>`;
+
 const MoviesList = ({ store }) => {
   const { movies = [] } = store;
   return html`
@@ -80,6 +130,7 @@ const MoviesList = ({ store }) => {
             html`<${Btn} text="×" class="icon danger" onClick="${ev => (ev.stopPropagation(), store.deleteMovie(movie))}" />`}
           </li>`
         )}
+        <${MoreBtn} next="${store.moviesNext}" onClick="${store.moreMovies}" />
       </ol>
     </div>
   `;
@@ -164,6 +215,7 @@ const ActorsList = ({ store }) => {
             html`<${Btn} text="×" class="icon danger" onClick="${ev => (ev.stopPropagation(), store.deleteActor(actor))}" />`}
           </li>`
         )}
+        <${MoreBtn} next="${store.actorsNext}" onClick="${store.moreActors}" />
       </ol>
     </div>
   `;
@@ -234,16 +286,28 @@ class ActorForm extends Component {
   }
 }
 
-const MovieActorForm = ({ id, store }) => {
-  const movie = store.movies.find(m => m.id === id);
-  const movieActorsIds = movie.actors.map(a => a.id);
-  const freeActors = store.actors.filter(a => !movieActorsIds.includes(a.id));
-  const selectActor = actor => store.addMovieActor(movie, actor);
-  return html`
+class MovieActorForm extends Component {
+  state = { q: '', found: null };
+
+  search = q => {
+    this.setState({ q });
+    if (!q.trim()) return this.setState({ found: null });
+    API.getActors(null, q).then(({ actors }) => this.state.q === q && this.setState({ found: actors }));
+  };
+
+  render({ id, store }, { q, found }) {
+    const movie = store.movies.find(m => m.id === id);
+    const movieActorsIds = movie.actors.map(a => a.id);
+    const freeActors = (found || store.actors).filter(a => !movieActorsIds.includes(a.id));
+    const selectActor = actor => store.addMovieActor(movie, actor);
+    return html`
     <div className="movieActorForm detailView">
       <h2>
         <span>Add Actor <small>to ${movie.title}</small></span>
       </h2>
+      <label class="formControl">
+        <input type="search" value="${q}" onInput="${ev => this.search(ev.target.value)}" placeholder="Search actors" />
+      </label>
       <ol class="subList selectList">
         ${freeActors.length === 0 && html`<li class="none">No free Actors</li>`}
         ${freeActors.map(
@@ -254,7 +318,8 @@ const MovieActorForm = ({ id, store }) => {
       </ol>
     </div>
   `;
-};
+  }
+}
 
 class Modal extends Component {
   render() {
@@ -283,7 +348,7 @@ class Modal extends Component {
 class App extends Component {
   constructor(props) {
     super(props);
-    this.state = { ...this.props, movies: [], actors: [], modal: null };
+    this.state = { ...this.props, movies: [], moviesNext: null, moviesPages: 1, actors: [], actorsNext: null, actorsPages: 1, modal: null };
   }
 
   componentDidMount() {
@@ -303,8 +368,19 @@ class App extends Component {
     window.location.href = this.state.logoutUrl;
   };
 
-  getMovies = () => API.getMovies().then(movies => this.setState({ movies }));
-  getActors = () => API.getActors().then(actors => this.setState({ actors }));
+  // reloads keep as many pages as "Load more" had loaded
+  getMovies = () =>
+    loadPages(API.getMovies, 'movies', this.state.moviesPages).then(({ items, next }) => this.setState({ movies: items, moviesNext: next }));
+  getActors = () =>
+    loadPages(API.getActors, 'actors', this.state.actorsPages).then(({ items, next }) => this.setState({ actors: items, actorsNext: next }));
+  moreMovies = () =>
+    API.getMovies(this.state.moviesNext).then(({ movies, next }) =>
+      this.setState({ movies: [...this.state.movies, ...movies], moviesNext: next, moviesPages: this.state.moviesPages + 1 })
+    );
+  moreActors = () =>
+    API.getActors(this.state.actorsNext).then(({ actors, next }) =>
+      this.setState({ actors: [...this.state.actors, ...actors], actorsNext: next, actorsPages: this.state.actorsPages + 1 })
+    );
   modalOn = (action, data) => this.setState({ modal: { action, data } });
   modalOff = () => this.setState({ modal: null });
 
@@ -312,11 +388,19 @@ class App extends Component {
     const { apiUrl, token } = this.state;
     if (!token) return;
     API.init(apiUrl, token);
-    Promise.all([API.getPermissions(), API.getMovies(), API.getActors()])
-      .then(([permissions, movies, actors]) => this.setState({ permissions, movies, actors }))
+    Promise.all([API.getPermissions(), this.getMovies(), this.getActors()])
+      .then(([permissions]) => this.setState({ permissions }))
+      .then(() => API.feed(this.onChange))
       .catch(this.logout);
   };
 
+  // other users' writes: reload the lists they touch, as deep as they were paged (an ETag check when nothing shown changed)
+  onChange = ({ movies = [], actors = [], cast = [], deleted = {} }) => {
+    const castChanged = cast.length > 0 || (deleted.cast || []).length > 0;
+    if (movies.length || (deleted.movies || []).length || castChanged) this.getMovies();
+    if (actors.length || (deleted.actors || []).length || castChanged) this.getActors();
+  };
+
   getStore = state => {
     const { permissions = [] } = state;
     return {
@@ -324,6 +408,8 @@ class App extends Component {
       logout: this.logout,
       modalOff: this.modalOff,
       modalOn: this.modalOn,
+      moreMovies: this.moreMovies,
+      moreActors: this.moreActors,
       can: perm => permissions.includes(perm),
       addMovie: data => (this.modalOff(), API.createMovie(data).then(this.getMovies)),
       saveMovie: data => {
@@ -0,0 +1,44 @@
+from flask import request, Response, stream_with_context, json
+from .config import STREAM_BATCH
+
+NDJSON = "application/x-ndjson"
+
+
+def wants_ndjson():
+    return any(mimetype == NDJSON for mimetype, _ in request.accept_mimetypes)
+
+
+def wants_stream():
+    '''Streaming was asked for with ?stream=1 or Accept: application/x-ndjson'''
+    return request.args.get("stream") == "1" or wants_ndjson()
+
+
+def stream_listing(query, key, serialize):
+    '''
+    Stream every row of a query, serializing each as it is read.
+    Rows are fetched STREAM_BATCH at a time through a server-side cursor,
+    so memory stays flat whatever the table size.
+    @INPUTS
+        query: ordered query
+        key: collection name in the JSON body, i.e. "movies"
+        serialize: row -> dict
+    @RETURNS
+        NDJSON (one record per line) if asked for in Accept, else { key: [...] } JSON
+    '''
+    rows = query.execution_options(stream_results=True).yield_per(STREAM_BATCH)
+
+    def ndjson():
+        for row in rows:
+            yield json.dumps(serialize(row)) + "\n"
+
+    def json_array():
+        yield f'{{"{key}":['
+        separator = ""
+        for row in rows:
+            yield separator + json.dumps(serialize(row))
+            separator = ","
+        yield "]}"
+
+    if wants_ndjson():
+        return Response(stream_with_context(ndjson()), mimetype=NDJSON)
+    return Response(stream_with_context(json_array()), mimetype="application/json")
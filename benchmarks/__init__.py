@@ -0,0 +1,4 @@
+'''
+Performance benchmarks, run as modules, i.e.
+    python -m benchmarks.serializers
+'''
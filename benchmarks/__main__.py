@@ -0,0 +1,100 @@
+'''
+Run the benchmark suite, write the results as JSON and compare them with a baseline
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --baseline results.json --threshold 0.2   # exits 1 on regressions
+
+Runs against a generated catalog in a temporary SQLite database, or --db
+(i.e. a local Postgres, migrated with `flask db upgrade`). Tokens are signed
+with the testing key, so the app runs with FLASK_ENV=testing.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="database url, defaults to a temporary SQLite file")
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--actors", type=int, default=2000)
+    parser.add_argument("--cast", type=int, default=5, help="actors per movie")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--group", choices=["micro", "macro"], help="only run this group")
+    parser.add_argument("--only", help="only run cases whose name contains this")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="results JSON of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 for 20%%")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    os.environ["DATABASE_URL"] = args.db or "sqlite:///" + tempfile.mkstemp(suffix=".db")[1]
+    os.environ["FLASK_ENV"] = "testing"
+
+    import sqlalchemy
+    from app import APP
+    from app.models import db
+    from . import auth, datagen, routes, serializers
+    from .harness import measure, compare
+
+    with APP.app_context():
+        if not args.db:
+            db.create_all()
+        datagen.clear()
+        movie_ids, actor_ids = datagen.generate(args.movies, args.actors, args.cast, args.seed)
+        dialect = db.session.get_bind().dialect.name
+
+    # cases run outside the app context, so every request gets a fresh session like in production
+    suite = serializers.cases(APP) + auth.cases(APP) + routes.cases(APP, movie_ids, actor_ids)
+    results = {}
+    try:
+        for case in suite:
+            if args.group and case.group != args.group or args.only and args.only not in case.name:
+                continue
+            results[case.name] = measure(case, args.repeat, args.warmup)
+            result = results[case.name]
+            print(f"{case.name:<36}{result['median_ms']:>10.2f} ms  p95 {result['p95_ms']:>8.2f} ms")
+    finally:
+        with APP.app_context():
+            datagen.clear()
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "sqlalchemy": sqlalchemy.__version__,
+            "database": dialect,
+            "movies": args.movies,
+            "actors": args.actors,
+            "cast": args.cast,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression['name']}: {regression['baseline']:.2f} -> "
+                  f"{regression['current']:.2f} ms (+{regression['change']:.0%})")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+'''
+Micro benchmarks of requires_auth: token verification cold and from the verified-token cache
+'''
+from flask import jsonify
+from app.auth import TOKEN_CACHE, requires_auth, verify_decode_jwt
+from .harness import Case
+from .routes import bearer
+
+
+def cases(app):
+    header = bearer()
+    token = header["Authorization"].split(" ")[1]
+
+    @requires_auth("movies:list")
+    def view(payload):
+        return jsonify({})
+
+    def call_view(*_):
+        with app.test_request_context("/", headers=header):
+            view()
+
+    return [
+        Case("verify_decode_jwt cold", "micro", lambda _: verify_decode_jwt(token), TOKEN_CACHE.clear),
+        Case("verify_decode_jwt cached", "micro", lambda: verify_decode_jwt(token)),
+        Case("requires_auth cold", "micro", call_view, TOKEN_CACHE.clear),
+        Case("requires_auth cached", "micro", call_view),
+    ]
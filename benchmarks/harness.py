@@ -0,0 +1,56 @@
+import time
+import statistics
+from collections import namedtuple
+
+# name: unique case name, group: "micro" | "macro"
+# run: the timed callable, called with what setup returned (setup is not timed)
+Case = namedtuple("Case", ["name", "group", "run", "setup"], defaults=[None])
+
+
+def measure(case, repeat=20, warmup=2):
+    '''
+    Time a case
+    @RETURNS
+        { group, runs, min_ms, median_ms, mean_ms, p95_ms, max_ms }
+    '''
+    samples = []
+    for i in range(warmup + repeat):
+        arg = case.setup() if case.setup else None
+        start = time.perf_counter()
+        case.run(arg) if case.setup else case.run()
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            samples.append(elapsed * 1000)
+
+    samples.sort()
+    return {
+        "group": case.group,
+        "runs": len(samples),
+        "min_ms": round(samples[0], 4),
+        "median_ms": round(statistics.median(samples), 4),
+        "mean_ms": round(statistics.mean(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        "max_ms": round(samples[-1], 4),
+    }
+
+
+def compare(results, baseline, threshold=0.2, metric="median_ms"):
+    '''
+    Cases slower than the baseline by more than threshold
+    @INPUTS
+        results, baseline: { name: measure() result }
+        threshold: allowed slowdown, 0.2 for 20%
+    @RETURNS
+        [{ name, baseline, current, change }] sorted by slowdown, worst first
+    '''
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before or not before.get(metric):
+            continue
+        change = result[metric] / before[metric] - 1
+        if change > threshold:
+            regressions.append({"name": name, "baseline": before[metric], "current": result[metric],
+                                "change": round(change, 4)})
+    regressions.sort(key=lambda regression: -regression["change"])
+    return regressions
@@ -0,0 +1,153 @@
+'''
+Macro benchmarks: every route of app/routes.py, through the Flask test client
+'''
+import itertools
+from jose import jwt
+from app.config import TESTING_JWT_KEY
+from app.models import db, Movie, Actor, movie_actors, insert_ignoring_conflicts
+from app.response_cache import RESPONSE_CACHE
+from .harness import Case
+
+PERMISSIONS = ["movies:list", "movies:create", "movies:update", "movies:delete",
+               "actors:list", "actors:create", "actors:update", "actors:delete"]
+BATCH = 100
+
+
+def bearer(permissions=PERMISSIONS):
+    '''Authorization header of a testing-mode (HS256) token'''
+    return {"Authorization": "Bearer " + jwt.encode({"permissions": permissions}, TESTING_JWT_KEY)}
+
+
+def cases(app, movie_ids, actor_ids):
+    '''
+    @INPUTS
+        app: Flask app
+        movie_ids, actor_ids: ids of the generated catalog
+    '''
+    client = app.test_client()
+    headers = bearer()
+    counter = itertools.count()
+
+    def call(method, url, json=None, expect=200, extra=None):
+        response = client.open(url, method=method, json=json, headers={**headers, **(extra or {})})
+        if response.status_code != expect:
+            raise AssertionError(f"{method} {url}: {response.status_code}")
+        response.get_data()
+        return response
+
+    def get(url, extra=None, warm=False):
+        '''GET case, with the response cache cleared before each run unless warm'''
+        setup = None if warm else RESPONSE_CACHE.clear
+        return lambda *_: call("GET", url, extra=extra), setup
+
+    def in_context(fn):
+        '''Run a setup in its own app context, like a request, so no session state leaks into the next run'''
+        def run(*args):
+            with app.app_context():
+                return fn(*args)
+        return run
+
+    @in_context
+    def insert(model, rows):
+        result = db.session.execute(model.__table__.insert(), rows)
+        db.session.commit()
+        if len(rows) == 1:
+            return result.inserted_primary_key[0]
+        key = model.title if model is Movie else model.name
+        return [id for (id,) in db.session.query(model.id).filter(key.in_([row[key.key] for row in rows]))]
+
+    def new_movies(n):
+        return [{"title": f"Bench Run Movie {next(counter):07d}", "release_date": "2020-01-01"} for _ in range(n)]
+
+    def new_actors(n):
+        return [{"name": f"Bench Run Actor {next(counter):07d}", "age": 40, "gender": "F"} for _ in range(n)]
+
+    movie, actor = movie_ids[len(movie_ids) // 2], actor_ids[len(actor_ids) // 2]
+    casts = itertools.cycle([actor_ids[:10], actor_ids[10:20]])
+    links = [{"movie_id": m, "actor_id": a} for m, a in zip(movie_ids[:BATCH], reversed(actor_ids))]
+
+    @in_context
+    def unlink(*_):
+        db.session.execute(movie_actors.delete().where(movie_actors.c.movie_id == movie)
+                           .where(movie_actors.c.actor_id == actor))
+        db.session.commit()
+
+    @in_context
+    def link(*_):
+        db.session.execute(insert_ignoring_conflicts(movie_actors), [{"movie_id": movie, "actor_id": actor}])
+        db.session.commit()
+
+    @in_context
+    def unlink_batch():
+        for row in links:
+            db.session.execute(movie_actors.delete().where(movie_actors.c.movie_id == row["movie_id"])
+                               .where(movie_actors.c.actor_id == row["actor_id"]))
+        db.session.commit()
+
+    reads = [
+        ("GET /", "/", None),
+        ("GET /health", "/health", None),
+        ("GET /user", "/user", None),
+        ("GET /search", "/search?q=silent+river", None),
+        ("GET /movies", "/movies", None),
+        ("GET /movies limit=1000", "/movies?limit=1000", None),
+        ("GET /movies fields", "/movies?limit=1000&fields=title", None),
+        ("GET /movies expand", "/movies?limit=1000&fields=title&expand=actors.name", None),
+        ("GET /movies q", "/movies?q=golden", None),
+        ("GET /movies ndjson", "/movies", {"Accept": "application/x-ndjson"}),
+        ("GET /movies/:id", f"/movies/{movie}", None),
+        ("GET /actors", "/actors", None),
+        ("GET /actors limit=1000", "/actors?limit=1000", None),
+        ("GET /actors q", "/actors?q=maya", None),
+        ("GET /actors ndjson", "/actors", {"Accept": "application/x-ndjson"}),
+        ("GET /actors/:id", f"/actors/{actor}", None),
+    ]
+    suite = []
+    for name, url, extra in reads:
+        run, setup = get(url, extra)
+        suite.append(Case(name, "macro", run, setup))
+    for name, url in [("GET /movies cached", "/movies"), ("GET /actors cached", "/actors")]:
+        run, _ = get(url, warm=True)
+        suite.append(Case(name, "macro", run))
+
+    suite += [
+        Case("POST /movies", "macro", lambda row: call("POST", "/movies", row), lambda: new_movies(1)[0]),
+        Case("PATCH /movies/:id", "macro",
+             lambda date: call("PATCH", f"/movies/{movie}", {"release_date": date}),
+             lambda: f"20{next(counter) % 100:02d}-01-01"),
+        Case("DELETE /movies/:id", "macro",
+             lambda id: call("DELETE", f"/movies/{id}"), lambda: insert(Movie, new_movies(1))),
+        Case("POST /movies/bulk", "macro",
+             lambda rows: call("POST", "/movies/bulk", {"movies": rows}), lambda: new_movies(BATCH)),
+        Case("PATCH /movies/bulk", "macro",
+             lambda date: call("PATCH", "/movies/bulk", {"movies": [
+                 {"id": id, "release_date": date} for id in movie_ids[:BATCH]]}),
+             lambda: f"20{next(counter) % 100:02d}-01-01"),
+        Case("DELETE /movies/bulk", "macro",
+             lambda ids: call("DELETE", "/movies/bulk", {"ids": ids}), lambda: insert(Movie, new_movies(BATCH))),
+        Case("POST /movies/:id/actors", "macro",
+             lambda _: call("POST", f"/movies/{movie}/actors", {"actor": {"id": actor}}), unlink),
+        Case("DELETE /movies/:id/actors", "macro",
+             lambda _: call("DELETE", f"/movies/{movie}/actors", {"actor": {"id": actor}}), link),
+        Case("PUT /movies/:id/actors", "macro",
+             lambda cast: call("PUT", f"/movies/{movie}/actors", {"actors": cast}), lambda: next(casts)),
+        Case("PATCH /movies/:id/actors", "macro",
+             lambda cast: call("PATCH", f"/movies/{movie}/actors", {"add": cast, "remove": actor_ids[:20]}),
+             lambda: next(casts)),
+        Case("POST /movie-actors", "macro",
+             lambda _: call("POST", "/movie-actors", {"links": links}), unlink_batch),
+        Case("POST /actors", "macro", lambda row: call("POST", "/actors", row), lambda: new_actors(1)[0]),
+        Case("PATCH /actors/:id", "macro",
+             lambda age: call("PATCH", f"/actors/{actor}", {"age": age}), lambda: 20 + next(counter) % 60),
+        Case("DELETE /actors/:id", "macro",
+             lambda id: call("DELETE", f"/actors/{id}"), lambda: insert(Actor, new_actors(1))),
+        Case("POST /actors/bulk", "macro",
+             lambda rows: call("POST", "/actors/bulk", {"actors": rows}), lambda: new_actors(BATCH)),
+        Case("PATCH /actors/bulk", "macro",
+             lambda age: call("PATCH", "/actors/bulk", {"actors": [
+                 {"id": id, "age": age} for id in actor_ids[:BATCH]]}),
+             lambda: 20 + next(counter) % 60),
+        Case("DELETE /actors/bulk", "macro",
+             lambda ids: call("DELETE", "/actors/bulk", {"ids": ids}), lambda: insert(Actor, new_actors(BATCH))),
+    ]
+    return suite
@@ -0,0 +1,49 @@
+'''
+Micro benchmarks of the model serializers:
+    - orm: Movie.listing() instances -> data() -> jsonify (the pre row-pipeline path)
+    - rows: app.serializers.list_page Core rows -> dicts -> orjson
+'''
+from flask import jsonify
+from app.models import db, Movie, Actor
+from app.fieldsets import Fieldset
+from app.serializers import list_page, json_response
+from .harness import Case
+
+LIMIT = 1000
+
+
+def cases(app):
+    def in_request(fn):
+        def run(*_):
+            with app.test_request_context():
+                fn()
+                db.session.expunge_all()
+        return run
+
+    def orm(model, key):
+        def run():
+            objects = model.listing().order_by(getattr(model, model.SORT_KEY), model.id).limit(LIMIT).all()
+            jsonify({key: [obj.data() for obj in objects]}).get_data()
+        return run
+
+    def rows(model, key, fieldset=None):
+        def run():
+            records, _ = list_page(model, fieldset, limit=LIMIT)
+            json_response({key: records}).get_data()
+        return run
+
+    def orm_single(model):
+        def run():
+            model.query.order_by(model.id).first().data()
+        return run
+
+    titles = Fieldset(("id", "title"), {"actors": ("name",)})
+    return [
+        Case("serialize movies orm", "micro", in_request(orm(Movie, "movies"))),
+        Case("serialize movies rows", "micro", in_request(rows(Movie, "movies"))),
+        Case("serialize movies rows fieldset", "micro", in_request(rows(Movie, "movies", titles))),
+        Case("serialize actors orm", "micro", in_request(orm(Actor, "actors"))),
+        Case("serialize actors rows", "micro", in_request(rows(Actor, "actors"))),
+        Case("Movie.data()", "micro", in_request(orm_single(Movie))),
+        Case("Actor.data()", "micro", in_request(orm_single(Actor))),
+    ]
@@ -8,5 +8,11 @@ case $1 in
 
   test) FLASK_ENV=testing python test_app.py ;;
 
+  test-asgi) APP_MODE=asgi FLASK_ENV=testing python test_app.py ;;
+
+  assets) flask assets build ;;
+
+  asgi) uvicorn app.asgi:ASGI_APP --port 8000 --reload ;;
+
   *) echo "Unknow command"
 esac
@@ -0,0 +1,32 @@
+"""resource version counters
+
+Revision ID: 5b9ce6463f88
+Revises: b7ea6a3c90b3
+Create Date: 2026-10-18 10:12:41.552390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9ce6463f88'
+down_revision = 'b7ea6a3c90b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    resource_versions = op.create_table('resource_versions',
+                                        sa.Column('name', sa.String(), nullable=False),
+                                        sa.Column('version', sa.Integer(), nullable=False),
+                                        sa.PrimaryKeyConstraint('name')
+                                        )
+    op.bulk_insert(resource_versions, [
+        {'name': 'movies', 'version': 0},
+        {'name': 'actors', 'version': 0},
+    ])
+
+
+def downgrade():
+    op.drop_table('resource_versions')
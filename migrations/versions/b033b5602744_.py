@@ -0,0 +1,30 @@
+"""title / name unique indexes and movie_actors.actor_id index
+
+Revision ID: b033b5602744
+Revises: 5b9ce6463f88
+Create Date: 2026-10-18 11:03:17.240815
+
+Duplicate titles / names must be cleaned up before upgrading,
+the unique indexes cannot be built over them.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b033b5602744'
+down_revision = '5b9ce6463f88'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_movies_title', 'movies', ['title'], unique=True)
+    op.create_index('ix_actors_name', 'actors', ['name'], unique=True)
+    op.create_index('ix_movie_actors_actor_id', 'movie_actors', ['actor_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_movie_actors_actor_id', table_name='movie_actors')
+    op.drop_index('ix_actors_name', table_name='actors')
+    op.drop_index('ix_movies_title', table_name='movies')
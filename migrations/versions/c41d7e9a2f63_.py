@@ -0,0 +1,50 @@
+"""updated_at / change_seq on movies, actors and movie_actors, tombstones
+
+Revision ID: c41d7e9a2f63
+Revises: ee2b6a116d0f
+Create Date: 2026-10-18 14:22:37.118204
+
+Existing rows are stamped with change 1, the first GET /changes?since=0 returns them all.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7e9a2f63'
+down_revision = 'ee2b6a116d0f'
+branch_labels = None
+depends_on = None
+
+TABLES = ('movies', 'actors', 'movie_actors')
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(), nullable=True))
+        op.add_column(table, sa.Column('change_seq', sa.Integer(), nullable=True))
+        op.execute(f'UPDATE {table} SET updated_at = CURRENT_TIMESTAMP, change_seq = 1')
+        op.create_index(f'ix_{table}_change_seq', table, ['change_seq'], unique=False)
+
+    op.create_table('tombstones',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('table_name', sa.String(), nullable=False),
+                    sa.Column('record_id', sa.Integer(), nullable=False),
+                    sa.Column('related_id', sa.Integer(), nullable=True),
+                    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+                    sa.Column('change_seq', sa.Integer(), nullable=True),
+                    sa.PrimaryKeyConstraint('id')
+                    )
+    op.create_index('ix_tombstones_change_seq', 'tombstones', ['change_seq'], unique=False)
+    op.execute("INSERT INTO resource_versions (name, version) VALUES ('changes', 1)")
+
+
+def downgrade():
+    op.execute("DELETE FROM resource_versions WHERE name = 'changes'")
+    op.drop_index('ix_tombstones_change_seq', table_name='tombstones')
+    op.drop_table('tombstones')
+    for table in reversed(TABLES):
+        op.drop_index(f'ix_{table}_change_seq', table_name=table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('change_seq')
+            batch_op.drop_column('updated_at')
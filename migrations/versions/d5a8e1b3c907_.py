@@ -0,0 +1,44 @@
+"""NOTIFY catalog_changes on every write transaction
+
+Revision ID: d5a8e1b3c907
+Revises: c41d7e9a2f63
+Create Date: 2026-10-18 16:05:52.407719
+
+Postgres only: fires when the change counter is bumped, the message is sent at
+commit, so every worker's GET /feed wakes up whichever process wrote.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a8e1b3c907'
+down_revision = 'c41d7e9a2f63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('''
+        CREATE OR REPLACE FUNCTION notify_catalog_changes() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('catalog_changes', NEW.version::text);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    ''')
+    op.execute('''
+        CREATE TRIGGER resource_versions_notify
+        AFTER INSERT OR UPDATE ON resource_versions
+        FOR EACH ROW WHEN (NEW.name = 'changes')
+        EXECUTE PROCEDURE notify_catalog_changes()
+    ''')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('DROP TRIGGER resource_versions_notify ON resource_versions')
+    op.execute('DROP FUNCTION notify_catalog_changes()')
@@ -0,0 +1,34 @@
+"""trigram search indexes on movies.title and actors.name
+
+Revision ID: ee2b6a116d0f
+Revises: b033b5602744
+Create Date: 2026-10-18 11:48:05.913402
+
+Postgres only: other databases search through the in-memory index of app.search.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ee2b6a116d0f'
+down_revision = 'b033b5602744'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_movies_title_trgm', 'movies', ['title'],
+                    postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
+    op.create_index('ix_actors_name_trgm', 'actors', ['name'],
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_actors_name_trgm', table_name='actors')
+    op.drop_index('ix_movies_title_trgm', table_name='movies')